@@ -17,33 +17,72 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
         Otherwise, return None.
 
     """
+    found = dijkstras_shortest_paths(initial_position, [destination], graph, adj)
+    if destination not in found:
+        return False
+    return found[destination][1]
+
+def dijkstras_shortest_paths(initial_position, destinations, graph, adj):
+    """ Searches for minimal cost paths from one cell to several destinations with a single expansion.
+
+    The search stops as soon as every destination has been reached, so the work shared between the paths
+    is done once.
+
+    Args:
+        initial_position: The initial cell from which the paths extend.
+        destinations: The end locations for the paths, e.g. level['waypoints'].values().
+        graph: A loaded level, containing walls, spaces, and waypoints.
+        adj: An adjacency function returning cells adjacent to a given cell as well as their respective edge costs.
+
+    Returns:
+        A dictionary mapping each reachable destination to its path cost and the list of cells from
+        initial_position to it. Unreachable destinations are left out.
+
+    """
+    remaining = set(destinations)
+    found = {}
     paths = {initial_position: []}          # maps cells to previous cells on path
     pathcosts = {initial_position: 0}       # maps cells to their pathcosts (found so far)
     queue = []
     heappush(queue, (0, initial_position))  # maintain a priority queue of cells
-    
-    while queue:
+
+    while queue and remaining:
         priority, cell = heappop(queue)
-        if cell == destination:
-            return path_to_cell(cell, paths)
-        
+        if priority > pathcosts[cell]:
+            continue                        # stale entry, the cell was reached more cheaply since
+
+        if cell in remaining:
+            remaining.discard(cell)
+            found[cell] = (priority, path_to_cell(cell, paths))
+
         # investigate children
         for (child, step_cost) in adj(graph, cell):
             # calculate cost along this path to child
-            cost_to_child = priority + transition_cost(graph, cell, child)
+            cost_to_child = priority + step_cost
             if child not in pathcosts or cost_to_child < pathcosts[child]:
                 pathcosts[child] = cost_to_child            # update the cost
                 paths[child] = cell                         # set the backpointer
                 heappush(queue, (cost_to_child, child))     # put the child on the priority queue
-            
-    return False
+
+    return found
 
 def path_to_cell(cell, paths):
-    if cell == []:
-        return []
-    return path_to_cell(paths[cell], paths) + [cell]
-    
+    """ Follows the backpointers from cell to the start of the search.
 
+    Args:
+        cell: The cell the path ends at.
+        paths: A dictionary mapping cells to the previous cell on their path, and the initial cell to [].
+
+    Returns:
+        The list of cells from the initial cell to cell.
+
+    """
+    path = []
+    while cell != []:
+        path.append(cell)
+        cell = paths[cell]
+    path.reverse()
+    return path
 
 
 def navigation_edges(level, cell):
@@ -0,0 +1,116 @@
+# Array-backed Dijkstra over maze_environment levels
+
+from math import inf, sqrt
+import sys
+
+import numpy
+
+from maze_environment import level_grid, load_level_grid, save_grid_costs
+
+
+def distance_map(grid, source, delta=None):
+    """ Computes the cost of the cheapest path from source to every cell of a grid.
+
+    Paths move between the 8 neighbors of a cell like navigation_edges, and an edge costs its length times
+    the average cost of its two cells like transition_cost, so the costs are those Dijkstra's algorithm
+    finds. Instead of taking cells off a priority queue one at a time, cells are settled in bands of
+    delta cost, and the whole band is relaxed at once with array operations over precomputed neighbor
+    offsets into the flattened grid. A cell in the band is relaxed again if another one improves it.
+
+    Args:
+        grid: A grid from level_grid.
+        source: The level cell (i, j) paths start from.
+        delta: The width of a band, a positive number, by default the average cost of a cell, or 1 when
+            that is 0.
+
+    Returns:
+        A 2D array, like grid['cost'], of path costs from source, inf where no path reaches.
+
+    """
+    if delta is not None and not delta > 0:
+        raise ValueError('delta must be positive, got %r' % (delta,))
+
+    cost = grid['cost']
+    x0, y0 = grid['origin']
+    rows, cols = cost.shape
+    i, j = source[0] - x0, source[1] - y0
+    if not (0 <= j < rows and 0 <= i < cols) or cost[j, i] == inf:
+        return numpy.full(cost.shape, inf)
+
+    # A border of walls around the grid keeps every neighbor offset inside the flat array
+    width = cols + 2
+    padded = numpy.full((rows + 2, width), inf)
+    padded[1:-1, 1:-1] = cost
+    flat_cost = padded.ravel()
+    offsets, lengths = (numpy.array(column) for column in zip(*_neighbor_offsets(width)))
+
+    if delta is None:
+        # Cells of cost 0 make edges of length 0, and a band of width 0 would never hold a cell
+        open_costs = cost[cost < inf]
+        delta = float(open_costs.mean()) or 1.0
+
+    distances = numpy.full(flat_cost.shape, inf)
+    queued = numpy.zeros(flat_cost.shape, dtype=bool)
+    start = (j + 1) * width + i + 1
+    distances[start] = 0
+    queued[start] = True
+    pending = numpy.array([start])
+
+    while pending.size:
+        bound = distances[pending].min() + delta
+        while True:
+            in_band = distances[pending] < bound
+            band = pending[in_band]
+            if not band.size:
+                break
+            pending = pending[~in_band]
+            queued[band] = False
+
+            # All 8 neighbors of every cell in the band at once, one row per cell
+            neighbors = band[:, None] + offsets
+            costs = distances[band, None] + lengths * ((flat_cost[band, None] + flat_cost[neighbors]) / 2)
+            better = costs < distances[neighbors]
+            if better.any():
+                neighbors = neighbors[better]
+                numpy.minimum.at(distances, neighbors, costs[better])
+                improved = numpy.unique(neighbors)
+                improved = improved[~queued[improved]]
+                queued[improved] = True
+                pending = numpy.concatenate((pending, improved))
+
+    return distances.reshape(padded.shape)[1:-1, 1:-1].copy()
+
+
+def cell_costs(grid, distances):
+    """ Converts a distance array into the mapping of cells to costs that save_level_costs takes.
+
+    Args:
+        grid: The grid the distances were computed over.
+        distances: A 2D array from distance_map.
+
+    Returns:
+        A dictionary mapping each reachable level cell (i, j) to its cost.
+
+    """
+    x0, y0 = grid['origin']
+    js, is_ = numpy.nonzero(distances < inf)
+    return dict(zip(zip((is_ + x0).tolist(), (js + y0).tolist()), distances[js, is_].tolist()))
+
+
+def _neighbor_offsets(width):
+    # Flat index offsets of the 8 neighbors of a cell in a grid of the given row width, with their distance
+    diagonal = sqrt(2)
+    return [(-width - 1, diagonal), (-width, 1), (-width + 1, diagonal),
+            (-1, 1), (1, 1),
+            (width - 1, diagonal), (width, 1), (width + 1, diagonal)]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("usage: %s level.txt waypoint" % sys.argv[0])
+        sys.exit(-1)
+
+    _, filename, waypoint = sys.argv
+    grid = load_level_grid(filename)
+    distances = distance_map(grid, grid['waypoints'][waypoint])
+    save_grid_costs(distances)
@@ -1,9 +1,16 @@
 # Implements a maze environment containing cells with walls, spaces, and waypoints
 
+from collections.abc import Mapping, Set
+from hashlib import sha256
 from math import inf
-from csv import writer
+import gzip
+import os
+import sys
+
+import numpy
 
 WALL = 'X'
+COST_FORMATS = ('.csv', '.csv.gz', '.npy', '.npz')
 
 
 def load_level(filename):
@@ -41,6 +48,184 @@ def load_level(filename):
     return level
 
 
+def load_level_grid(filename, cache=False):
+    """ Loads a level from a given text file straight into arrays.
+
+    Takes a few bytes per cell where load_level takes dozens. With cache, the arrays are also saved as an
+    .npz next to the level holding a hash of the text, and later calls load that instead of parsing
+    while the text is unchanged.
+
+    Args:
+        filename: The name of the txt file containing the maze.
+        cache: Whether to load from and save to filename + '.npz'.
+
+    Returns:
+        The grid (dict) containing the cost of every cell as a 2D float32 array indexed [j, i] with inf at
+        walls and outside the level (cost), a matching bool array marking walls (walls), the level
+        coordinates of the arrays' first cell (origin), and a mapping of waypoints to locations (dict).
+        level_view makes a grid usable where a loaded level is expected.
+
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    digest = sha256(data).hexdigest()
+
+    cache_file = filename + '.npz'
+    if cache and os.path.exists(cache_file):
+        with numpy.load(cache_file) as saved:
+            if str(saved['level_hash']) == digest:
+                return {'cost': saved['cost'],
+                        'walls': saved['walls'],
+                        'origin': tuple(saved['origin'].tolist()),
+                        'waypoints': dict(zip(saved['waypoint_names'].tolist(),
+                                              map(tuple, saved['waypoint_cells'].tolist())))}
+
+    # One row of character codes per line, padded with spaces, which are outside the level
+    lines = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n')
+    chars = numpy.full((len(lines), max(map(len, lines))), ord(' '), dtype=numpy.uint8)
+    for j, line in enumerate(lines):
+        chars[j, :len(line)] = numpy.frombuffer(line, dtype=numpy.uint8)
+
+    walls = chars == ord(WALL)
+    digits = (chars >= ord('0')) & (chars <= ord('9'))
+    lower = (chars >= ord('a')) & (chars <= ord('z'))
+    known_rows = numpy.flatnonzero((walls | digits | lower).any(axis=1))
+    known_cols = numpy.flatnonzero((walls | digits | lower).any(axis=0))
+    if known_rows.size:
+        y_lo, y_hi, x_lo, x_hi = known_rows[0], known_rows[-1] + 1, known_cols[0], known_cols[-1] + 1
+    else:
+        y_lo = y_hi = x_lo = x_hi = 0
+    chars, walls, digits, lower = (a[y_lo:y_hi, x_lo:x_hi] for a in (chars, walls, digits, lower))
+
+    cost = numpy.full(chars.shape, inf, dtype=numpy.float32)
+    cost[digits] = chars[digits] - ord('0')
+    cost[lower] = 1.
+
+    # In reading order, so a repeated waypoint ends up at its last location as with load_level
+    waypoints = {}
+    for j, i in zip(*(numpy.nonzero(lower))):
+        waypoints[chr(chars[j, i])] = (int(i + x_lo), int(j + y_lo))
+
+    grid = {'cost': cost,
+            'walls': walls,
+            'origin': (int(x_lo), int(y_lo)),
+            'waypoints': waypoints}
+
+    if cache:
+        numpy.savez(cache_file, level_hash=digest, cost=cost, walls=walls, origin=numpy.array(grid['origin']),
+                    waypoint_names=numpy.array(list(waypoints), dtype=str),
+                    waypoint_cells=numpy.array(list(waypoints.values()), dtype=int).reshape(-1, 2))
+
+    return grid
+
+
+def level_view(grid):
+    """ Presents a grid from load_level_grid as a loaded level, without copying its cells.
+
+    Args:
+        grid: The grid to be viewed.
+
+    Returns:
+        A level (dict) whose walls and spaces read from the grid's arrays, usable with show_level,
+        save_level_costs, and the searches over levels.
+
+    """
+    return {'walls': _GridWalls(grid),
+            'spaces': _GridSpaces(grid),
+            'waypoints': grid['waypoints']}
+
+
+class _GridCells:
+    # Looks up level cells (i, j) in the arrays of a grid
+
+    def __init__(self, grid):
+        self._grid = grid
+        self._x0, self._y0 = grid['origin']
+        self._rows, self._cols = grid['cost'].shape
+
+    def _index(self, cell):
+        try:
+            j, i = cell[1] - self._y0, cell[0] - self._x0
+        except (TypeError, IndexError):
+            return None
+        if 0 <= j < self._rows and 0 <= i < self._cols:
+            return j, i
+        return None
+
+    def _cells(self, mask):
+        js, is_ = numpy.nonzero(mask)
+        return zip((is_ + self._x0).tolist(), (js + self._y0).tolist())
+
+
+class _GridSpaces(_GridCells, Mapping):
+
+    def __getitem__(self, cell):
+        index = self._index(cell)
+        if index is not None:
+            cost = self._grid['cost'][index]
+            if cost != inf:
+                return float(cost)
+        raise KeyError(cell)
+
+    def __contains__(self, cell):
+        index = self._index(cell)
+        return index is not None and self._grid['cost'][index] != inf
+
+    def __iter__(self):
+        return self._cells(self._grid['cost'] != inf)
+
+    def __len__(self):
+        return int(numpy.count_nonzero(self._grid['cost'] != inf))
+
+
+class _GridWalls(_GridCells, Set):
+
+    def __contains__(self, cell):
+        index = self._index(cell)
+        return index is not None and bool(self._grid['walls'][index])
+
+    def __iter__(self):
+        return self._cells(self._grid['walls'])
+
+    def __len__(self):
+        return int(numpy.count_nonzero(self._grid['walls']))
+
+
+def level_grid(level):
+    """ Converts a loaded level into a cost grid.
+
+    Args:
+        level: A loaded level, containing walls, spaces, and waypoints.
+
+    Returns:
+        The grid (dict) containing the cost of every cell as a 2D array indexed [j, i] with inf at walls
+        (cost), a matching bool array marking walls (walls), the level coordinates of the arrays' first
+        cell (origin), and the waypoints (dict), like load_level_grid.
+
+    """
+    if isinstance(level['spaces'], _GridSpaces):
+        return level['spaces']._grid
+
+    cells = list(level['spaces'].keys()) + list(level['walls'])
+    xs, ys = zip(*cells)
+    x_lo, y_lo = min(xs), min(ys)
+
+    cost = numpy.full((max(ys) - y_lo + 1, max(xs) - x_lo + 1), inf)
+    if level['spaces']:
+        spaces = numpy.array(list(level['spaces'].keys()))
+        cost[spaces[:, 1] - y_lo, spaces[:, 0] - x_lo] = list(level['spaces'].values())
+
+    walls = numpy.zeros(cost.shape, dtype=bool)
+    if level['walls']:
+        wall_cells = numpy.array(list(level['walls']))
+        walls[wall_cells[:, 1] - y_lo, wall_cells[:, 0] - x_lo] = True
+
+    return {'cost': cost,
+            'walls': walls,
+            'origin': (x_lo, y_lo),
+            'waypoints': dict(level['waypoints'])}
+
+
 def show_level(level, path=[]):
     """ Displays a level via a print statement.
 
@@ -49,33 +234,54 @@ def show_level(level, path=[]):
         path: A continuous path to be displayed over the level, if provided.
 
     """
-    xs, ys = zip(*(list(level['spaces'].keys()) + list(level['walls'])))
-    x_lo, x_hi = min(xs), max(xs)
-    y_lo, y_hi = min(ys), max(ys)
+    write_level(level_grid(level), sys.stdout, path)
+    print()
 
-    path_cells = set(path)
 
-    chars = []
-    inverted_waypoints = {point: char for char, point in level['waypoints'].items()}
+def write_level(grid, f, path=[], chunk_rows=1024):
+    """ Writes a grid as level text, a few rows at a time.
 
-    for j in range(y_lo, y_hi + 1):
-        for i in range(x_lo, x_hi + 1):
+    Walls are drawn as X, waypoints by their character, spaces by their (single digit) cost, and the cells
+    of path as *, like show_level.
 
-            cell = (i, j)
-            if cell in path_cells:
-                chars.append('*')
-            elif cell in level['walls']:
-                chars.append('X')
-            elif cell in inverted_waypoints:
-                chars.append(inverted_waypoints[cell])
-            elif cell in level['spaces']:
-                chars.append(str(int(level['spaces'][cell])))
-            else:
-                chars.append(' ')
+    Args:
+        grid: The grid to be written.
+        f: A text file to write to.
+        path: A continuous path to be displayed over the level, if provided.
+        chunk_rows: The number of rows rendered at once.
+
+    """
+    cost, walls = grid['cost'], grid['walls']
+    x0, y0 = grid['origin']
+    rows, cols = cost.shape
+    if not cols:
+        f.write('\n' * rows)
+        return
+
+    marks = [(cell, char) for char, cell in grid['waypoints'].items()] + [(cell, '*') for cell in path]
+    if marks:
+        mark_is = numpy.array([cell[0] for cell, _ in marks]) - x0
+        mark_js = numpy.array([cell[1] for cell, _ in marks]) - y0
+        mark_chars = numpy.array([ord(char) for _, char in marks], dtype=numpy.uint32)
+        inside = (mark_is >= 0) & (mark_is < cols) & (mark_js >= 0) & (mark_js < rows)
+        mark_is, mark_js, mark_chars = mark_is[inside], mark_js[inside], mark_chars[inside]
 
-        chars.append('\n')
+    for top in range(0, rows, chunk_rows):
+        bottom = min(top + chunk_rows, rows)
+        chunk_cost = cost[top:bottom]
 
-    print(''.join(chars))
+        # Character codes of the rows, read back as one string per row
+        codes = numpy.full(chunk_cost.shape, ord(' '), dtype=numpy.uint32)
+        spaces = chunk_cost != inf
+        codes[spaces] = ord('0') + chunk_cost[spaces].astype(numpy.uint32)
+        codes[walls[top:bottom]] = ord(WALL)
+        if marks:
+            # Later marks win, so the path is drawn over waypoints
+            here = (mark_js >= top) & (mark_js < bottom)
+            codes[mark_js[here] - top, mark_is[here]] = mark_chars[here]
+
+        f.write('\n'.join(codes.view('U%d' % cols)[:, 0].tolist()))
+        f.write('\n')
 
 
 def save_level_costs(level, costs, filename='distance_map.csv'):
@@ -84,30 +290,59 @@ def save_level_costs(level, costs, filename='distance_map.csv'):
     Args:
         level: The level to be displayed.
         costs: A dictionary containing a mapping of cells to costs from an origin point.
-        filename: The name of the csv file to be created.
+        filename: The name of the file to be created, see save_grid_costs for the formats.
+
+    """
+    grid = level_grid(level)
+    x0, y0 = grid['origin']
+    rows, cols = grid['cost'].shape
+
+    # An object array keeps each cost as it was given, so an int cost still saves as 0 rather than 0.0
+    distances = numpy.full((rows, cols), inf, dtype=object)
+    if costs:
+        cells = numpy.array(list(costs.keys()))
+        values = numpy.empty(len(costs), dtype=object)
+        values[:] = list(costs.values())
+        i, j = cells[:, 0] - x0, cells[:, 1] - y0
+        inside = (i >= 0) & (i < cols) & (j >= 0) & (j < rows)
+        distances[j[inside], i[inside]] = values[inside]
+
+    save_grid_costs(distances, filename)
+
+
+def save_grid_costs(distances, filename='distance_map.csv', chunk_rows=1024):
+    """ Saves a 2D array of cell costs, e.g. from grid_dijkstra.distance_map.
+
+    The format follows the extension: .csv and gzip-compressed .csv.gz text with one row of the level per
+    line, written a few rows at a time, .npy for the array itself, and compressed .npz holding it as
+    'costs'.
+
+    Text output writes each cost as csv.writer does, so an object array of ints and floats keeps the
+    type of each value. .npy and .npz hold floats.
+
+    Args:
+        distances: A 2D array of costs indexed [j, i], inf where there is no cost.
+        filename: The name of the file to be created.
+        chunk_rows: The number of rows formatted at once for text output.
 
     """
-    xs, ys = zip(*(list(level['spaces'].keys()) + list(level['walls'])))
-    x_lo, x_hi = min(xs), max(xs)
-    y_lo, y_hi = min(ys), max(ys)
-
-    rows = []
-    for j in range(y_lo, y_hi + 1):
-        row = []
-
-        for i in range(x_lo, x_hi + 1):
-            cell = (i, j)
-            if cell not in costs:
-                row.append(inf)
-            else:
-                row.append(costs[cell])
-
-        rows.append(row)
-
-    assert '.csv' in filename, 'Error: filename does not contain file type.'
-    with open(filename, 'w', newline='') as f:
-        csv_writer = writer(f)
-        for row in rows:
-            csv_writer.writerow(row)
-
-    print("Saved file:", filename)
\ No newline at end of file
+    assert filename.endswith(COST_FORMATS), 'Error: filename does not end in one of %s.' % (COST_FORMATS,)
+
+    if filename.endswith(('.npy', '.npz')):
+        distances = numpy.asarray(distances, dtype=float)
+    if filename.endswith('.npy'):
+        numpy.save(filename, distances)
+    elif filename.endswith('.npz'):
+        numpy.savez_compressed(filename, costs=distances)
+    else:
+        if filename.endswith('.gz'):
+            f = gzip.open(filename, 'wt', compresslevel=6, newline='')
+        else:
+            f = open(filename, 'w', newline='')
+        with f:
+            for top in range(0, len(distances), chunk_rows):
+                # Numbers print as csv.writer prints them, one \r\n terminated line per row
+                rows = distances[top:top + chunk_rows].tolist()
+                f.write(''.join(','.join(map(str, row)) + '\r\n' for row in rows))
+
+    print("Saved file:", filename)
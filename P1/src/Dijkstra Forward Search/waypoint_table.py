@@ -0,0 +1,117 @@
+# Precomputed costs and paths between every pair of waypoints of a level, cached on disk
+
+from hashlib import sha256
+from math import inf
+import multiprocessing
+import os
+import pickle
+import sys
+
+from maze_environment import load_level
+from Dijkstra_forward_search import dijkstras_shortest_paths, navigation_edges
+
+# Bumped whenever the contents of a table change, so older cache files are not picked up
+TABLE_VERSION = 1
+
+# The level each worker process searches
+_worker_level = None
+
+
+def waypoint_table(filename, processes=None, cache_dir=None):
+    """ Finds the cheapest path between every pair of waypoints in a level, or loads them from the cache.
+
+    Each waypoint is expanded once, with all the waypoints as destinations, and the waypoints are spread
+    over worker processes. The table is saved next to the level (or in cache_dir) under a name holding a
+    hash of the level file, so a later call for the same file loads it instead of searching, and an
+    edited level is searched again.
+
+    Args:
+        filename: The name of the text file containing the level.
+        processes: The number of worker processes, by default the number of cores. 1 searches in this process.
+        cache_dir: The directory for the cache file, by default the directory of the level.
+
+    Returns:
+        The table (dict) containing the sorted waypoint names (waypoints), the cost of the cheapest path from
+        each waypoint to each other keyed by (source, destination) name pairs, inf when there is none
+        (costs), and the list of cells on each of those paths that exists (paths).
+
+    """
+    with open(filename, 'rb') as f:
+        digest = sha256(f.read()).hexdigest()
+
+    cache_file = table_cache_file(filename, digest, cache_dir)
+    if os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            table = pickle.load(f)
+        if table.get('version') == TABLE_VERSION and table.get('level_hash') == digest:
+            return table
+
+    level = load_level(filename)
+    names = sorted(level['waypoints'])
+    processes = processes or os.cpu_count() or 1
+
+    if processes == 1 or len(names) < 2:
+        rows = [_table_row(level, name) for name in names]
+    else:
+        # Under fork the workers share the loaded level with this process instead of receiving a copy
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        with context.Pool(min(processes, len(names)), initializer=_init_worker, initargs=(level,)) as pool:
+            rows = pool.map(_run_row, names, chunksize=1)
+
+    costs = {}
+    paths = {}
+    for source, row in zip(names, rows):
+        for destination in names:
+            if destination in row:
+                costs[(source, destination)], paths[(source, destination)] = row[destination]
+            else:
+                costs[(source, destination)] = inf
+
+    table = {'version': TABLE_VERSION,
+             'level_hash': digest,
+             'waypoints': names,
+             'costs': costs,
+             'paths': paths}
+
+    # Write to a temporary name first so a reader never sees half a file
+    temporary = cache_file + '.%d.tmp' % os.getpid()
+    with open(temporary, 'wb') as f:
+        pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, cache_file)
+
+    return table
+
+
+def table_cache_file(filename, digest, cache_dir=None):
+    """ Names the cache file of the waypoint table for a level with the given content hash. """
+    directory = cache_dir if cache_dir is not None else os.path.dirname(os.path.abspath(filename))
+    return os.path.join(directory, '%s.%s.waypoints.pickle' % (os.path.basename(filename), digest[:16]))
+
+
+def _table_row(level, name):
+    # Costs and paths from one waypoint to every waypoint it can reach, keyed by waypoint name
+    waypoints = level['waypoints']
+    found = dijkstras_shortest_paths(waypoints[name], waypoints.values(), level, navigation_edges)
+    return {other: found[cell] for other, cell in waypoints.items() if cell in found}
+
+
+def _init_worker(level):
+    global _worker_level
+    _worker_level = level
+
+
+def _run_row(name):
+    return _table_row(_worker_level, name)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("usage: %s level.txt" % sys.argv[0])
+        sys.exit(-1)
+
+    table = waypoint_table(sys.argv[1])
+    for source in table['waypoints']:
+        print(source, ' '.join('%8.2f' % table['costs'][(source, destination)] for destination in table['waypoints']))
@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy
+
+from nm_compact import compact_mesh, load_mesh
+from nm_meshbuilder import build_mesh, load_walkable_mask
+import nm_pathfinder
+
+# Reproducible timings of mesh building and path search on the sample maps, written out as JSON so runs
+# from different revisions can be compared with --compare.
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+DEFAULT_MAPS = ['homer.png', 'test_image.png', 'ucsc_banana_slug.png']
+DEFAULT_SIZES = [4, 16, 64]
+
+# Bumped whenever a metric changes meaning. Reports without a schema are from schema 1.
+REPORT_SCHEMA = 2
+
+# The schema in which each metric last changed meaning. Schema 2 counts expansions with SearchStats
+# rather than the length of the explored list, which also holds boxes only reached and never expanded.
+METRIC_SCHEMAS = {'expansions_mean': 2, 'expansions_max': 2, 'heap_pops_mean': 2}
+
+
+def random_queries(mesh, count, seed=0):
+    """
+    Picks seeded random (source_point, destination_point) pairs inside the boxes of a mesh
+
+    Boxes are picked uniformly, so queries do not crowd into the largest open areas.
+
+    Args:
+        mesh: pathway constraints the paths adhere to
+        count: number of queries
+        seed: seed of the random generator, the same seed gives the same queries
+
+    Returns:
+        A list of (source_point, destination_point) pairs
+    """
+    graph = nm_pathfinder.mesh_graph(mesh)
+    boxes = [graph.box(node) for node in graph.nodes()]
+    if not boxes:
+        return []
+    rng = random.Random(seed)
+
+    def point():
+        x1, x2, y1, y2 = rng.choice(boxes)
+        return (rng.uniform(x1, x2), rng.uniform(y1, y2))
+
+    return [(point(), point()) for _ in range(count)]
+
+
+def latency_summary(seconds):
+    """
+    Returns:
+        A dict with the mean and the p50, p95 and p99 of a list of durations, in milliseconds
+    """
+    if not seconds:
+        return {'mean_ms': None, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    ms = numpy.array(seconds) * 1000
+    p50, p95, p99 = numpy.percentile(ms, [50, 95, 99]).tolist()
+    return {'mean_ms': float(ms.mean()), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+
+
+def mesh_size(mesh):
+    """
+    Returns:
+        A dict with the number of boxes and of (undirected) edges of a mesh
+    """
+    graph = nm_pathfinder.mesh_graph(mesh)
+    nodes = list(graph.nodes())
+    return {'boxes': len(nodes), 'edges': sum(len(graph.neighbors(node)) for node in nodes) // 2}
+
+
+def peak_memory(function, *args):
+    """
+    Runs function once under tracemalloc
+
+    Returns:
+        The result of the call and the peak number of bytes Python allocated during it
+    """
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def benchmark_build(maps, sizes, repeat=3):
+    """
+    Times build_mesh for every map and min_feature_size
+
+    Args:
+        maps: paths of map images
+        sizes: min_feature_size values to build with
+        repeat: timed builds per combination, the fastest and median are reported
+
+    Returns:
+        A list with one result dict per (map, min_feature_size)
+    """
+    results = []
+    for filename in maps:
+        mask = load_walkable_mask(filename)
+        for size in sizes:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                mesh = build_mesh(mask, size)
+                times.append(time.perf_counter() - start)
+            _, peak = peak_memory(build_mesh, mask, size)
+            result = {'map': os.path.basename(filename),
+                      'pixels': int(mask.size),
+                      'min_feature_size': size,
+                      'best_s': min(times),
+                      'median_s': float(numpy.median(times)),
+                      'peak_bytes': peak}
+            result.update(mesh_size(mesh))
+            results.append(result)
+    return results
+
+
+def benchmark_search(meshes, algorithms, query_count, seed=0):
+    """
+    Runs the same seeded random queries through each search algorithm on each mesh
+
+    Args:
+        meshes: dict mapping a name to a mesh
+        algorithms: names of searches, keys of nm_pathfinder.ALGORITHMS
+        query_count: number of queries per mesh
+        seed: seed for random_queries
+
+    Returns:
+        A list with one result dict per (mesh, algorithm)
+    """
+    results = []
+    for name, mesh in meshes.items():
+        queries = random_queries(mesh, query_count, seed)
+        nm_pathfinder.box_index(mesh)
+        for algorithm in algorithms:
+            times = []
+            expansions = []
+            pops = []
+            found = 0
+            for source_point, destination_point in queries:
+                stats = nm_pathfinder.SearchStats()
+                start = time.perf_counter()
+                path, _ = nm_pathfinder.find_path(source_point, destination_point, mesh, algorithm, stats)
+                times.append(time.perf_counter() - start)
+                expansions.append(stats.expanded)
+                pops.append(stats.pops)
+                found += bool(path)
+            _, peak = peak_memory(nm_pathfinder.find_paths, queries, mesh, algorithm)
+
+            result = {'mesh': name,
+                      'algorithm': algorithm,
+                      'queries': len(queries),
+                      'found': found,
+                      'expansions_mean': float(numpy.mean(expansions)) if expansions else None,
+                      'expansions_max': max(expansions, default=None),
+                      'heap_pops_mean': float(numpy.mean(pops)) if pops else None,
+                      'peak_bytes': peak}
+            result.update(latency_summary(times))
+            result.update(mesh_size(mesh))
+            results.append(result)
+    return results
+
+
+def run_benchmarks(maps=None, sizes=None, algorithms=None, query_count=200, seed=0, repeat=3, compact=False):
+    """
+    Runs the build and search benchmarks
+
+    Searches run on the prebuilt .mesh.pickle next to each map when there is one, otherwise on a mesh
+    built with min_feature_size 16.
+
+    Args:
+        maps: paths of map images, defaults to the sample maps in P1/input
+        sizes: min_feature_size values for the build benchmark
+        algorithms: searches to time, defaults to all of nm_pathfinder.ALGORITHMS
+        query_count: queries per mesh
+        seed: seed for the random queries
+        repeat: timed builds per combination
+        compact: also search the compact form of each mesh
+
+    Returns:
+        The report, a dict ready for json.dump
+    """
+    maps = maps or [os.path.join(INPUT_DIR, name) for name in DEFAULT_MAPS]
+    sizes = sizes or DEFAULT_SIZES
+    algorithms = algorithms or sorted(nm_pathfinder.ALGORITHMS)
+
+    meshes = {}
+    for filename in maps:
+        name = os.path.basename(filename)
+        if os.path.exists(filename + '.mesh.pickle'):
+            meshes[name] = load_mesh(filename + '.mesh.pickle')
+        else:
+            meshes[name] = build_mesh(load_walkable_mask(filename), 16)
+        if compact:
+            meshes[name + ' (compact)'] = compact_mesh(meshes[name])
+
+    return {'schema': REPORT_SCHEMA,
+            'revision': _revision(),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'seed': seed,
+            'build': benchmark_build(maps, sizes, repeat),
+            'search': benchmark_search(meshes, algorithms, query_count, seed)}
+
+
+def compare_reports(baseline, report):
+    """
+    Lines up two reports from run_benchmarks
+
+    Metrics whose meaning changed between the schemas of the two reports are left out.
+
+    Returns:
+        A list of (section, key, metric, baseline value, new value, new / baseline) rows
+    """
+    metrics = {'build': ('best_s', 'peak_bytes', 'boxes'),
+               'search': ('p50_ms', 'p95_ms', 'p99_ms', 'expansions_mean', 'peak_bytes')}
+    keys = {'build': lambda r: (r['map'], r['min_feature_size']),
+            'search': lambda r: (r['mesh'], r['algorithm'])}
+    oldest = min(baseline.get('schema', 1), report.get('schema', 1))
+    rows = []
+    for section, names in metrics.items():
+        old = {keys[section](r): r for r in baseline.get(section, [])}
+        for r in report.get(section, []):
+            key = keys[section](r)
+            if key not in old:
+                continue
+            for metric in names:
+                if METRIC_SCHEMAS.get(metric, 1) > oldest:
+                    continue
+                before, after = old[key].get(metric), r.get(metric)
+                ratio = after / before if before and after is not None else None
+                rows.append((section, key, metric, before, after, ratio))
+    return rows
+
+
+def _revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark mesh building and pathfinding")
+    parser.add_argument('maps', nargs='*', help="map images, defaults to the samples in P1/input")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="min_feature_size values")
+    parser.add_argument('--algorithms', nargs='+', choices=sorted(nm_pathfinder.ALGORITHMS))
+    parser.add_argument('--queries', type=int, default=200, help="random queries per mesh")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="timed builds per map and size")
+    parser.add_argument('--compact', action='store_true', help="also search compact meshes")
+    parser.add_argument('--output', help="file to write the JSON report to instead of stdout")
+    parser.add_argument('--compare', help="an earlier report to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.maps, args.sizes, args.algorithms, args.queries, args.seed, args.repeat,
+                            args.compact)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for section, key, metric, before, after, ratio in compare_reports(baseline, report):
+            change = "%.2fx" % ratio if ratio is not None else "n/a"
+            print("%-6s %-40s %-16s %12s -> %-12s %s" % (section, key, metric, before, after, change),
+                  file=sys.stderr)
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+
+import nm_pathfinder
+
+
+class PathCache:
+    """
+    Remembers the corridor of boxes found between pairs of boxes so repeated queries skip the search
+
+    Entries are keyed on (source box, destination box) and evicted least recently used first. On a hit
+    only the detail points for the new endpoints are recomputed along the stored corridor.
+
+    Code that edits a mesh in place should bump mesh['version'] so caches holding it start over. With
+    smooth, paths are pulled taut through the corridor with nm_pathfinder.funnel_path.
+    """
+
+    def __init__(self, capacity=1024, algorithm='regular', smooth=False):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if algorithm not in nm_pathfinder.ALGORITHMS:
+            raise ValueError("Unknown algorithm %r, expected one of %s"
+                             % (algorithm, ', '.join(nm_pathfinder.ALGORITHMS)))
+
+        self.capacity = capacity
+        self.algorithm = algorithm
+        self.smooth = smooth
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._mesh = None
+        self._mesh_version = None
+
+    def find_path(self, source_point, destination_point, mesh):
+        """
+        Searches for a path from source_point to destination_point, reusing a cached corridor if there is one
+
+        Args:
+            source_point: starting point of the pathfinder
+            destination_point: the ultimate goal the pathfinder must reach
+            mesh: pathway constraints the path adheres to
+
+        Returns:
+            A path (list of points) from source_point to destination_point if exists
+            A list of boxes explored by the algorithm, just the corridor on a cache hit
+        """
+        # A different mesh, or the same one edited since, makes every entry stale
+        if mesh is not self._mesh or mesh.get('version') != self._mesh_version:
+            self.clear()
+            self._mesh = mesh
+            self._mesh_version = mesh.get('version')
+
+        source_box = nm_pathfinder.locate_box(source_point, mesh)
+        destination_box = nm_pathfinder.locate_box(destination_point, mesh)
+        if source_box is None or destination_box is None:
+            return nm_pathfinder.find_path(source_point, destination_point, mesh, self.algorithm,
+                                           smooth=self.smooth)
+
+        key = (source_box, destination_box)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            corridor = self._entries[key]
+            if not corridor:
+                return [], []
+            if self.smooth:
+                return nm_pathfinder.funnel_path(source_point, destination_point, corridor), list(corridor)
+            return nm_pathfinder.corridor_path(source_point, destination_point, corridor), list(corridor)
+
+        self.misses += 1
+        path, explored, corridor = nm_pathfinder.find_corridor(source_point, destination_point, mesh,
+                                                               self.algorithm, smooth=self.smooth)
+
+        # Unreachable pairs are remembered too, as an empty corridor
+        self._entries[key] = tuple(corridor)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+        return path, explored
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """
+        Returns:
+            A dict with the hit and miss counts, the hit rate and the current and maximum number of entries
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'capacity': self.capacity}
+
+    def __len__(self):
+        return len(self._entries)
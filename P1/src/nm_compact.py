@@ -0,0 +1,269 @@
+import gc
+import math
+import pickle
+import struct
+
+import numpy
+
+# Binary mesh files: a header, a table of named array sections, then the arrays themselves
+MESH_FILE_MAGIC = b'NMSH'
+MESH_FILE_VERSION = 1
+_HEADER = struct.Struct('<4sII4x')
+_SECTION = struct.Struct('<16s8sQQQ')
+_NAME_SIZE = 16
+_DTYPE_SIZE = 8
+_ALIGNMENT = 64
+
+
+def compact_mesh(mesh):
+    """
+    Converts a mesh from build_mesh into the compact array-backed format
+
+    Boxes become integer ids, the row of each box in the 'boxes' array. Adjacency is stored in CSR form:
+    the neighbors of box i are adj_indices[adj_offsets[i]:adj_offsets[i + 1]].
+
+    Args:
+        mesh: a mesh as built by build_mesh, {'boxes': list, 'adj': dict}
+
+    Returns:
+        A dict with the 'boxes' array (one x1, x2, y1, y2 row per box), 'adj_offsets' and 'adj_indices',
+        and 'portal_boxes' when the mesh has stored portals
+    """
+    box_list = list(mesh['boxes'])
+    ids = {box: i for i, box in enumerate(box_list)}
+
+    # Keep integer coordinates integral, some meshes were built from rescaled images
+    coords = [c for box in box_list for c in box]
+    dtype = numpy.int32 if all(float(c).is_integer() for c in coords) else numpy.float64
+    boxes = numpy.array(box_list, dtype=dtype).reshape(len(box_list), 4)
+
+    adj_offsets = numpy.zeros(len(box_list) + 1, dtype=numpy.int64)
+    neighbors = []
+    for i, box in enumerate(box_list):
+        box_neighbors = mesh['adj'].get(box, [])
+        neighbors.extend(ids[b] for b in box_neighbors)
+        adj_offsets[i + 1] = adj_offsets[i] + len(box_neighbors)
+    adj_indices = numpy.array(neighbors, dtype=numpy.int32)
+
+    compact = {'boxes': boxes, 'adj_offsets': adj_offsets, 'adj_indices': adj_indices}
+
+    # Stored portals follow adj_indices, one row per neighbor entry
+    if 'portals' in mesh:
+        portals = [portal for box in box_list for portal in mesh['portals'].get(box, [])]
+        compact['portal_boxes'] = numpy.array(portals, dtype=dtype).reshape(len(portals), 4)
+
+    return compact
+
+
+def expand_mesh(mesh):
+    """
+    Converts a compact mesh back into the {'boxes': list, 'adj': dict} format of build_mesh
+
+    Args:
+        mesh: a compact mesh as returned by compact_mesh
+
+    Returns:
+        The same mesh keyed by box tuples
+    """
+    box_list = [tuple(box) for box in mesh['boxes'].tolist()]
+    offsets = mesh['adj_offsets'].tolist()
+    indices = mesh['adj_indices'].tolist()
+    adj = {box: [box_list[j] for j in indices[offsets[i]:offsets[i + 1]]] for i, box in enumerate(box_list)}
+    expanded = {'boxes': box_list, 'adj': adj}
+    if 'portal_boxes' in mesh:
+        portals = [tuple(portal) for portal in mesh['portal_boxes'].tolist()]
+        expanded['portals'] = {box: portals[offsets[i]:offsets[i + 1]] for i, box in enumerate(box_list)}
+    return expanded
+
+
+def is_compact(mesh):
+    return 'adj_offsets' in mesh
+
+
+def load_compact_mesh(filename):
+    """
+    Reads a mesh pickle written by nm_meshbuilder and converts it to the compact format
+
+    Args:
+        filename: path of the .mesh.pickle file
+
+    Returns:
+        The compact mesh
+    """
+    with open(filename, 'rb') as f:
+        return compact_mesh(pickle.load(f))
+
+
+def save_mesh_file(mesh, filename):
+    """
+    Writes a compact mesh as a binary mesh file that load_mesh_file can memory-map
+
+    Every numpy array in the mesh is stored as a named section, so extra per-mesh tables travel along with
+    the boxes and adjacency.
+
+    Args:
+        mesh: a compact mesh, or a build_mesh mesh which is converted first
+        filename: path of the file to write
+    """
+    if not is_compact(mesh):
+        mesh = compact_mesh(mesh)
+
+    sections = [(name, numpy.ascontiguousarray(array)) for name, array in mesh.items()
+                if isinstance(array, numpy.ndarray)]
+
+    # The section table has fixed-width fields, which would silently cut longer names short
+    for name, array in sections:
+        if len(name.encode('ascii')) > _NAME_SIZE:
+            raise ValueError("Section name %r is longer than %d bytes" % (name, _NAME_SIZE))
+        if len(array.dtype.str.encode('ascii')) > _DTYPE_SIZE:
+            raise ValueError("dtype %r of section %r is longer than %d bytes" % (array.dtype.str, name, _DTYPE_SIZE))
+        if array.ndim not in (1, 2):
+            raise ValueError("Section %r has %d dimensions, only 1 or 2 can be stored" % (name, array.ndim))
+
+    # Lay the arrays out after the header and section table, each on an aligned offset
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    table = []
+    for name, array in sections:
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        rows = array.shape[0]
+        cols = array.shape[1] if array.ndim > 1 else 0
+        table.append(_SECTION.pack(name.encode('ascii'), array.dtype.str.encode('ascii'), rows, cols, offset))
+        offset += array.nbytes
+
+    with open(filename, 'wb') as f:
+        f.write(_HEADER.pack(MESH_FILE_MAGIC, MESH_FILE_VERSION, len(sections)))
+        for entry in table:
+            f.write(entry)
+        for (name, array), entry in zip(sections, table):
+            f.seek(_SECTION.unpack(entry)[4])
+            f.write(array.tobytes())
+
+
+def load_mesh_file(filename):
+    """
+    Opens a binary mesh file written by save_mesh_file without reading the arrays into memory
+
+    The arrays are read-only memory maps, so processes opening the same file share its page cache.
+
+    Args:
+        filename: path of the binary mesh file
+
+    Returns:
+        The compact mesh
+    """
+    with open(filename, 'rb') as f:
+        magic, version, count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MESH_FILE_MAGIC:
+            raise ValueError("%s is not a binary mesh file" % filename)
+        if version != MESH_FILE_VERSION:
+            raise ValueError("%s has mesh file version %d, expected %d" % (filename, version, MESH_FILE_VERSION))
+        table = [_SECTION.unpack(f.read(_SECTION.size)) for _ in range(count)]
+
+    mesh = {}
+    for name, dtype, rows, cols, offset in table:
+        shape = (rows, cols) if cols else (rows,)
+        name = name.rstrip(b'\0').decode('ascii')
+        dtype = numpy.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        if rows == 0:
+            mesh[name] = numpy.zeros(shape, dtype=dtype)
+        else:
+            mesh[name] = numpy.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+    return mesh
+
+
+def load_mesh(filename):
+    """
+    Reads a mesh from either a binary mesh file or a .mesh.pickle
+
+    Args:
+        filename: path of the mesh file
+
+    Returns:
+        A compact mesh for binary files, otherwise the pickled mesh as stored
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(len(MESH_FILE_MAGIC))
+    if magic == MESH_FILE_MAGIC:
+        return load_mesh_file(filename)
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+class CompactGraph:
+    """
+    Search view of a compact mesh: nodes are box ids and per-query buffers are lists indexed by id
+
+    The arrays are turned into Python lists once per mesh, as reading numpy one element at a time is
+    slow. Score, parent and flag lists are kept between queries: release hands them back, resetting only
+    the boxes the query reached, so a short query stays cheap however large the mesh is.
+    """
+
+    no_node = -1
+
+    def __init__(self, mesh):
+        self.size = len(mesh['boxes'])
+        # Millions of small tuples are made here, none of them in cycles, so the collector is paused
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            self.boxes = list(map(tuple, mesh['boxes'].tolist()))
+            offsets = mesh['adj_offsets'].tolist()
+            indices = mesh['adj_indices'].tolist()
+            spans = list(zip(offsets, offsets[1:]))
+            self._neighbors = [indices[start:end] for start, end in spans]
+            if mesh.get('portal_boxes') is not None:
+                portals = list(map(tuple, mesh['portal_boxes'].tolist()))
+                self._portals = [portals[start:end] for start, end in spans]
+            else:
+                # Without stored portals the neighbor box stands in, which constrains points the same way
+                boxes = self.boxes
+                self._portals = [[boxes[neighbor] for neighbor in neighbors] for neighbors in self._neighbors]
+        finally:
+            if collecting:
+                gc.enable()
+        self._free_scores = []
+        self._free_parents = []
+        self._free_flags = []
+
+    def nodes(self):
+        return range(self.size)
+
+    def box(self, node):
+        return self.boxes[node]
+
+    def neighbors(self, node):
+        return self._neighbors[node]
+
+    def edges(self, node):
+        return zip(self._neighbors[node], self._portals[node])
+
+    def scores(self):
+        return self._free_scores.pop() if self._free_scores else [math.inf] * self.size
+
+    def parents(self):
+        return self._free_parents.pop() if self._free_parents else [self.no_node] * self.size
+
+    def points(self):
+        # A dict, so it also records the boxes the query reached, in the order it reached them
+        return {}
+
+    def flags(self):
+        return self._free_flags.pop() if self._free_flags else [False] * self.size
+
+    def release(self, points, scores=None, parents=None, flags=None):
+        """
+        Hands back the buffers of a finished query for later ones, resetting the boxes in points
+
+        A search must give every box it writes a score, parent or flag for a point.
+        """
+        for buffer, value, free in ((scores, math.inf, self._free_scores),
+                                    (parents, self.no_node, self._free_parents),
+                                    (flags, False, self._free_flags)):
+            if buffer is not None:
+                for node in points:
+                    buffer[node] = value
+                free.append(buffer)
+
+    def explored(self, points):
+        boxes = self.boxes
+        return [boxes[node] for node in points]
@@ -0,0 +1,299 @@
+from heapq import heappush, heappop
+import math
+import time
+
+import nm_pathfinder
+
+# A two level view of a mesh. Boxes are grouped into clusters by cutting the map in half along its longer
+# side, the way build_mesh splits it, until each piece holds few enough boxes. Boxes with a neighbor in
+# another cluster are entrances, and the coarse graph links the entrances of each cluster to one another
+# with precomputed corridors, and to their neighbors across cluster borders.
+
+
+def build_hierarchy(mesh, cluster_size=64):
+    """
+    Partitions the boxes of a mesh into clusters and precomputes the coarse graph between cluster entrances
+
+    Args:
+        mesh: pathway constraints the path adheres to
+        cluster_size: the most boxes a cluster may hold before it is split again
+
+    Returns:
+        A dict with the 'mesh', the 'cluster' of every box, each cluster's 'entrances', the coarse 'edges'
+        as (entrance, cost, corridor) lists and the connected 'component' of every box
+    """
+    graph = nm_pathfinder.mesh_graph(mesh)
+    nodes = list(graph.nodes())
+    centers = {node: _center(graph.box(node)) for node in nodes}
+
+    # Split the map the way build_mesh does, sending each box to the half holding its center
+    cluster = {}
+    cluster_count = 0
+    if nodes:
+        x_hi = max(graph.box(node)[1] for node in nodes)
+        y_hi = max(graph.box(node)[3] for node in nodes)
+        work = [((0, x_hi, 0, y_hi), nodes)]
+        while work:
+            (x1, x2, y1, y2), members = work.pop()
+            if len(members) <= cluster_size or (x2 - x1 <= 1 and y2 - y1 <= 1):
+                for node in members:
+                    cluster[node] = cluster_count
+                cluster_count += 1
+                continue
+            if x2 - x1 > y2 - y1:
+                cut = int(x1 + (x2 - x1) / 2 + 1)
+                halves = [(x1, cut, y1, y2), (cut, x2, y1, y2)]
+                first = [node for node in members if centers[node][0] < cut]
+            else:
+                cut = int(y1 + (y2 - y1) / 2 + 1)
+                halves = [(x1, x2, y1, cut), (x1, x2, cut, y2)]
+                first = [node for node in members if centers[node][1] < cut]
+            in_first = set(first)
+            second = [node for node in members if node not in in_first]
+            for half, half_members in zip(halves, (first, second)):
+                if half_members:
+                    work.append((half, half_members))
+
+    entrances = {}
+    for node in nodes:
+        if any(cluster[neighbor] != cluster[node] for neighbor in graph.neighbors(node)):
+            entrances.setdefault(cluster[node], []).append(node)
+
+    # Coarse edges: within a cluster along the best local corridor, across borders straight to the neighbor
+    edges = {}
+    for cluster_id, cluster_entrances in entrances.items():
+        for entrance in cluster_entrances:
+            dist, points, prev = _local_search(graph, cluster, entrance, centers[entrance])
+            links = edges.setdefault(entrance, [])
+            for other in cluster_entrances:
+                if other != entrance and dist[other] < math.inf:
+                    cost = dist[other] + nm_pathfinder.heuristic(points[other], centers[other])
+                    links.append((other, cost, _corridor(prev, other)))
+            for neighbor in graph.neighbors(entrance):
+                if cluster[neighbor] != cluster_id:
+                    portal = nm_pathfinder.portal_between(graph.box(entrance), graph.box(neighbor))
+                    crossing = nm_pathfinder.constrain_point_to_box(centers[entrance], portal)
+                    cost = (nm_pathfinder.heuristic(centers[entrance], crossing)
+                            + nm_pathfinder.heuristic(crossing, centers[neighbor]))
+                    links.append((neighbor, cost, [entrance, neighbor]))
+
+    # Connected components answer unreachable queries without any search
+    component = {}
+    for start in nodes:
+        if start in component:
+            continue
+        component[start] = start
+        stack = [start]
+        while stack:
+            current = stack.pop()
+            for neighbor in graph.neighbors(current):
+                if neighbor not in component:
+                    component[neighbor] = start
+                    stack.append(neighbor)
+
+    return {'mesh': mesh,
+            'version': mesh.get('version'),
+            'cluster': cluster,
+            'entrances': entrances,
+            'edges': edges,
+            'component': component}
+
+
+def find_path_hierarchical(source_point, destination_point, hierarchy, mode='fast'):
+    """
+    Searches for a path with a coarse search over cluster entrances followed by local refinement
+
+    Args:
+        source_point: starting point of the pathfinder
+        destination_point: the ultimate goal the pathfinder must reach
+        hierarchy: the result of build_hierarchy for the mesh to search
+        mode: 'fast' follows the precomputed corridors between entrances, which is near-optimal;
+            'exact' uses the coarse level only to reject unreachable queries and then searches every box
+
+    Returns:
+        A path (list of points) from source_point to destination_point if exists
+        A list of boxes explored by the algorithm
+        The number of nodes expanded, counting both levels
+    """
+    mesh = hierarchy['mesh']
+    if mesh.get('version') != hierarchy['version']:
+        raise ValueError("The mesh changed since the hierarchy was built, rebuild it")
+    if mode not in ('fast', 'exact'):
+        raise ValueError("Unknown mode %r, expected 'fast' or 'exact'" % (mode,))
+
+    graph = nm_pathfinder.mesh_graph(mesh)
+    source_box = nm_pathfinder.locate_box(source_point, mesh)
+    destination_box = nm_pathfinder.locate_box(destination_point, mesh)
+    if source_box is None or destination_box is None:
+        return [], [graph.box(box) for box in (source_box, destination_box) if box is not None], 0
+
+    component = hierarchy['component']
+    if component.get(source_box, source_box) != component.get(destination_box, destination_box):
+        return [], [graph.box(source_box), graph.box(destination_box)], 0
+
+    if mode == 'exact':
+        path, explored = nm_pathfinder.find_path(source_point, destination_point, mesh, 'regular')
+        return path, explored, len(explored)
+
+    cluster = hierarchy['cluster']
+    expanded = 0
+
+    # Both points in one cluster: try staying inside it first
+    if cluster.get(source_box) == cluster.get(destination_box):
+        dist, points, prev = _local_search(graph, cluster, source_box, source_point)
+        expanded += len(points)
+        if dist[destination_box] < math.inf:
+            corridor = [graph.box(node) for node in _corridor(prev, destination_box)]
+            return nm_pathfinder.corridor_path(source_point, destination_point, corridor), corridor, expanded
+
+    # Local searches from each endpoint out to the entrances of its cluster
+    source_dist, source_points, source_prev = _local_search(graph, cluster, source_box, source_point)
+    destination_dist, destination_points, destination_prev = _local_search(graph, cluster, destination_box,
+                                                                           destination_point)
+    expanded += len(source_points) + len(destination_points)
+
+    exits = {}
+    for entrance in hierarchy['entrances'].get(cluster.get(destination_box), []):
+        if destination_dist[entrance] < math.inf:
+            center = _center(graph.box(entrance))
+            exits[entrance] = destination_dist[entrance] + nm_pathfinder.heuristic(destination_points[entrance], center)
+
+    # Coarse A* over the entrances, starting from every entrance the source reaches
+    frontier = []
+    cost = {}
+    came_from = {}
+    for entrance in hierarchy['entrances'].get(cluster.get(source_box), []):
+        if source_dist[entrance] < math.inf:
+            center = _center(graph.box(entrance))
+            start_cost = source_dist[entrance] + nm_pathfinder.heuristic(source_points[entrance], center)
+            if start_cost < cost.get(entrance, math.inf):
+                cost[entrance] = start_cost
+                came_from[entrance] = None
+                heappush(frontier, (start_cost + nm_pathfinder.heuristic(center, destination_point), entrance))
+
+    best_cost = math.inf
+    best_exit = None
+    closed = set()
+    while frontier:
+        estimate, current = heappop(frontier)
+        if estimate >= best_cost:
+            break
+        if current in closed:
+            continue
+        closed.add(current)
+        expanded += 1
+
+        if current in exits and cost[current] + exits[current] < best_cost:
+            best_cost = cost[current] + exits[current]
+            best_exit = current
+
+        for neighbor, step, _ in hierarchy['edges'].get(current, []):
+            tentative = cost[current] + step
+            if tentative < cost.get(neighbor, math.inf):
+                cost[neighbor] = tentative
+                came_from[neighbor] = current
+                estimate = nm_pathfinder.heuristic(_center(graph.box(neighbor)), destination_point)
+                heappush(frontier, (tentative + estimate, neighbor))
+
+    if best_exit is None:
+        return [], [graph.box(node) for node in closed], expanded
+
+    # Stitch the corridor: source to the first entrance, the coarse edges, the last entrance to the destination
+    route = [best_exit]
+    while came_from[route[-1]] is not None:
+        route.append(came_from[route[-1]])
+    route.reverse()
+
+    nodes = _corridor(source_prev, route[0])
+    for a, b in zip(route, route[1:]):
+        corridor = next(corridor for other, _, corridor in hierarchy['edges'][a] if other == b)
+        nodes.extend(corridor[1:])
+    nodes.extend(reversed(_corridor(destination_prev, route[-1])[:-1]))
+
+    corridor = [graph.box(node) for node in nodes]
+    return nm_pathfinder.corridor_path(source_point, destination_point, corridor), corridor, expanded
+
+
+def compare_modes(queries, hierarchy):
+    """
+    Runs the same queries in both modes and reports how they differ
+
+    Args:
+        queries: iterable of (source_point, destination_point) pairs
+        hierarchy: the result of build_hierarchy for the mesh to search
+
+    Returns:
+        A dict per mode with the mean 'expanded' nodes, mean 'latency' in seconds and total path 'length',
+        plus the 'length_ratio' of fast to exact path lengths over queries both modes solved
+    """
+    queries = list(queries)
+    report = {}
+    lengths = {}
+    for mode in ('exact', 'fast'):
+        expanded = 0
+        elapsed = 0.0
+        lengths[mode] = []
+        for source_point, destination_point in queries:
+            start = time.perf_counter()
+            path, _, count = find_path_hierarchical(source_point, destination_point, hierarchy, mode)
+            elapsed += time.perf_counter() - start
+            expanded += count
+            lengths[mode].append(_path_length(path) if path else None)
+        report[mode] = {'expanded': expanded / max(1, len(queries)),
+                        'latency': elapsed / max(1, len(queries)),
+                        'length': sum(length for length in lengths[mode] if length is not None)}
+
+    both = [(fast, exact) for fast, exact in zip(lengths['fast'], lengths['exact'])
+            if fast is not None and exact is not None]
+    exact_total = sum(exact for _, exact in both)
+    report['length_ratio'] = sum(fast for fast, _ in both) / exact_total if exact_total else 1.0
+    return report
+
+
+def _center(box):
+    x1, x2, y1, y2 = box
+    return ((x1 + x2) / 2, (y1 + y2) / 2)
+
+
+def _path_length(path):
+    return sum(nm_pathfinder.heuristic(a, b) for a, b in zip(path, path[1:]))
+
+
+def _corridor(prev, node):
+    corridor = [node]
+    while prev.get(corridor[-1]) is not None:
+        corridor.append(prev[corridor[-1]])
+    corridor.reverse()
+    return corridor
+
+
+def _local_search(graph, cluster, start, start_point):
+    # Dijkstra from start_point that never leaves the cluster of start
+    home = cluster.get(start)
+    dist = {start: 0}
+    points = {start: start_point}
+    prev = {start: None}
+    closed = set()
+    frontier = [(0, start)]
+    while frontier:
+        _, current = heappop(frontier)
+        if current in closed:
+            continue
+        closed.add(current)
+        for neighbor, portal in graph.edges(current):
+            if cluster.get(neighbor) != home:
+                continue
+            point = nm_pathfinder.constrain_point_to_box(points[current], portal)
+            tentative = dist[current] + nm_pathfinder.heuristic(points[current], point)
+            if tentative < dist.get(neighbor, math.inf):
+                dist[neighbor] = tentative
+                points[neighbor] = point
+                prev[neighbor] = current
+                heappush(frontier, (tentative, neighbor))
+    return _Distances(dist), points, prev
+
+
+class _Distances(dict):
+    # Boxes the local search did not reach are infinitely far away
+    def __missing__(self, key):
+        return math.inf
@@ -1,20 +1,25 @@
+import logging
 import sys
 import random
-import pickle
 import traceback
 import tkinter
 
+import nm_compact
 import nm_pathfinder
 
 if len(sys.argv) != 4:
-    print("usage: %s map.gif map.mesh.pickle subsample_factor" % sys.argv[0])
+    print("usage: %s map.gif map.mesh.pickle|map.mesh.bin subsample_factor" % sys.argv[0])
     sys.exit(-1)
 
 _, MAP_FILENAME, MESH_FILENAME, SUBSAMPLE = sys.argv
 SUBSAMPLE = int(SUBSAMPLE)
 
-with open(MESH_FILENAME, 'rb') as f:
-  mesh = pickle.load(f)
+# Either a .mesh.pickle or a binary .mesh.bin
+mesh = nm_compact.load_mesh(MESH_FILENAME)
+
+# Show what each search is doing on the console
+logging.basicConfig(format='%(message)s')
+logging.getLogger('nm_pathfinder').setLevel(logging.DEBUG)
 
 master = tkinter.Tk()
 
@@ -30,6 +35,8 @@ canvas.pack()
 def shrink(values):
     return [v/SUBSAMPLE for v in values]
 
+SEARCH_CHOICES = {'1': 'regular', '2': 'bidirectional'}
+
 source_point = None
 destination_point = None
 visited_boxes = []
@@ -75,7 +82,12 @@ def on_click(event):
     else:
         destination_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
         try:
-            path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, mesh)
+            search_choice = input("Enter 1 for Regular A* or 2 for Bidirectional A*: ")
+            if search_choice in SEARCH_CHOICES:
+                path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, mesh,
+                                                              SEARCH_CHOICES[search_choice])
+            else:
+                print("Invalid choice. Please enter 1 or 2.")
 
         except:
             destination_point = None
@@ -1,157 +1,516 @@
 import collections
+import os
 import pickle
 import sys
 import random
 
-from matplotlib.pyplot import imread, imsave
+from matplotlib.pyplot import imsave
 import numpy
-from numpy import zeros_like
-
-
-def build_mesh(image, min_feature_size):
-    def scan(box):
-
-        x1, x2, y1, y2 = box
-        area = (x2 - x1) * (y2 - y1)
-
-        if area < min_feature_size or (image[x1:x2, y1:y2] == 255).all() or (image[x1:x2, y1:y2] == 0).all():
-
-            # this box is simple enough to handle in one node
-            if (image[x1:x2, y1:y2] == 255).all():
-                return [box], []
-            else:
-                return [], []
-
+from PIL import Image
+
+from nm_compact import is_compact, save_mesh_file
+from nm_parallel import _pool_context
+import nm_pathfinder
+
+
+def load_walkable_mask(filename, shape=None, dtype=numpy.uint8, out=None, strip_rows=1024):
+    """
+    Reads a map into a boolean mask of its walkable pixels, a strip of rows at a time
+
+    A pixel is walkable where its first channel is at full intensity, 255 for 8-bit images. .npy and raw
+    sources are memory-mapped and converted one strip at a time, so only they are read in bounded memory.
+    Image files are decoded whole by PIL on the first strip, so the full picture is held in its own mode
+    while the mask is built. For maps too large for that, convert once with out='map.npy' on a machine
+    that can, then load map.npy. With out, the mask itself is a memory-mapped file.
+
+    Args:
+        filename: an image file, a .npy array, or a raw file of pixels when shape is given
+        shape: (rows, columns) or (rows, columns, channels) of a raw file
+        dtype: pixel type of a raw file
+        out: path of a .npy file to write the mask to
+        strip_rows: rows converted per step
+
+    Returns:
+        2D bool array, True where walkable, which build_mesh takes in place of the image
+    """
+    if shape is not None or filename.endswith('.npy'):
+        if shape is not None:
+            pixels = numpy.memmap(filename, dtype=dtype, mode='r', shape=tuple(shape))
         else:
+            pixels = numpy.load(filename, mmap_mode='r')
+        height, width = pixels.shape[:2]
+        full = _full_intensity(pixels.dtype)
 
-            # recursively split this big box on the longest dimension
-            if x2 - x1 > y2 - y1:
+        def read_strip(r0, r1):
+            strip = pixels[r0:r1]
+            if strip.ndim > 2:
+                strip = strip[:, :, 0]
+            return strip == full
 
-                cut = int(x1 + (x2 - x1) / 2 + 1)
-                first_box = (x1, cut, y1, y2)
-                second_box = (cut, x2, y1, y2)
+    else:
+        picture = Image.open(filename)
+        width, height = picture.size
+        if picture.mode == 'P':
+            # Look the first channel of each palette entry up instead of converting the whole image
+            palette = picture.getpalette() or []
+            lut = numpy.zeros(256, dtype=bool)
+            lut[:len(palette) // 3] = numpy.array(palette[0::3]) == 255
+            def convert(strip): return lut[strip]
+        elif picture.mode == '1':
+            def convert(strip): return strip
+        elif picture.mode in ('L', 'LA', 'RGB', 'RGBA', 'I;16'):
+            full = 65535 if picture.mode == 'I;16' else 255
+            def convert(strip): return (strip[:, :, 0] if strip.ndim > 2 else strip) == full
+        else:
+            raise ValueError("Unsupported image mode %r in %s" % (picture.mode, filename))
 
-                def rank(b): return (b[2], b[3])
+        def read_strip(r0, r1):
+            return convert(numpy.asarray(picture.crop((0, r0, width, r1))))
 
-                def first_touch(b): return b[1] == cut
+    if out is not None:
+        mask = numpy.lib.format.open_memmap(out, mode='w+', dtype=bool, shape=(height, width))
+    else:
+        mask = numpy.empty((height, width), dtype=bool)
+    for r0 in range(0, height, strip_rows):
+        r1 = min(height, r0 + strip_rows)
+        mask[r0:r1] = read_strip(r0, r1)
+    return mask
+
+
+def _full_intensity(dtype):
+    if dtype == bool:
+        return True
+    if numpy.issubdtype(dtype, numpy.floating):
+        return 1.0
+    if numpy.issubdtype(dtype, numpy.unsignedinteger):
+        return numpy.iinfo(dtype).max
+    raise ValueError("Unsupported pixel type %s" % dtype)
+
+
+def integral_image(mask, dtype=None, strip_rows=1024):
+    """
+    Builds a summed-area table of a boolean mask, one row and column larger than the mask
+
+    Works through the mask in strips of rows so only a strip's worth of temporaries is alive at once.
+
+    Args:
+        mask: 2D array, nonzero where the pixel counts
+        dtype: integer type of the table, picked from the mask size when None
+        strip_rows: rows converted per step
+
+    Returns:
+        table, where table[x, y] counts the nonzero pixels of mask[:x, :y]
+    """
+    height, width = mask.shape
+    if dtype is None:
+        dtype = numpy.int32 if height * width < 2 ** 31 else numpy.int64
+    table = numpy.zeros((height + 1, width + 1), dtype=dtype)
+    for r0 in range(0, height, strip_rows):
+        r1 = min(height, r0 + strip_rows)
+        strip = table[r0 + 1:r1 + 1, 1:]
+        numpy.cumsum(mask[r0:r1], axis=1, dtype=dtype, out=strip)
+        numpy.cumsum(strip, axis=0, out=strip)
+        strip += table[r0, 1:]
+    return table
 
-                def second_touch(b): return b[0] == cut
 
+def build_mesh(image, min_feature_size):
+    """
+    Cuts the walkable (255) pixels of image into boxes and finds which boxes touch
+
+    Boxes are split in half along their longer side until they are all walkable, all blocked, or smaller
+    than min_feature_size. On the way back up, boxes that line up exactly across a cut are merged and boxes
+    that touch across it become neighbors.
+
+    The split tree is scanned a whole level at a time, with summed-area tables answering every
+    homogeneity check in O(1), and then merged from the deepest level up, so there is no recursion and
+    no limit on map size from the interpreter's stack.
+
+    Args:
+        image: 2D uint8 array, 255 where walkable, or a bool mask from load_walkable_mask
+        min_feature_size: boxes with a smaller area are never split further
+
+    Returns:
+        The mesh, {'boxes': list of (x1, x2, y1, y2), 'adj': dict mapping each box to its neighbors}
+    """
+    levels, _ = _scan_levels(image, min_feature_size, (0, image.shape[0], 0, image.shape[1]))
+    return _mesh_from_result(_merge_levels(levels, []))
+
+
+def build_mesh_tiled(image, min_feature_size, processes=None, tiles_per_process=4):
+    """
+    Builds the same mesh as build_mesh, with the subtrees of the split tree built in parallel
+
+    The split tree is expanded here until it has a few pending boxes per worker. Each worker builds the
+    boxes and edges of its tiles, and the halves are then merged back together across every seam exactly
+    as build_mesh merges them.
+
+    Args:
+        image: 2D uint8 array, 255 where walkable, or a bool mask from load_walkable_mask
+        min_feature_size: boxes with a smaller area are never split further
+        processes: number of workers, defaults to the number of cores
+        tiles_per_process: how many tiles to aim for per worker, to even out their load
+
+    Returns:
+        The mesh, {'boxes': list of (x1, x2, y1, y2), 'adj': dict mapping each box to its neighbors}
+    """
+    processes = processes or os.cpu_count() or 1
+    root = (0, image.shape[0], 0, image.shape[1])
+    levels, tiles = _scan_levels(image, min_feature_size, root, stop_at=processes * tiles_per_process)
+    if not len(tiles):
+        return _mesh_from_result(_merge_levels(levels, []))
+
+    with _pool_context().Pool(processes, initializer=_init_tile_worker, initargs=(image, min_feature_size)) as pool:
+        tile_results = pool.map(_build_tile, [tuple(tile) for tile in tiles.tolist()], chunksize=1)
+
+    return _mesh_from_result(_merge_levels(levels, tile_results))
+
+
+def update_mesh(mesh, image, dirty_box, min_feature_size, pixels=None):
+    """
+    Rebuilds the part of a mesh covering a changed area of its image, in place
+
+    The boxes overlapping the dirty area are taken out and the area is rebuilt by the same splitting and
+    merging as build_mesh. A box crossing the border of the area keeps its parts outside as up to four
+    smaller boxes, so the rebuilt area stays that of the change rather than growing over every box it
+    reaches, and the cost follows the size of the change rather than of the map. Adjacency is then
+    reconnected across the border. Boxes are not merged across it, so repeated changes leave more boxes
+    than build_mesh would, and unlike build_mesh, boxes left without neighbors stay in the mesh so a
+    later change can connect them again.
+
+    mesh['version'] is bumped so caches holding the mesh start over. Stored portals are kept up to date.
+
+    Args:
+        mesh: a mesh from build_mesh, built from image
+        image: the uint8 image or bool mask the mesh was built from, already holding the change unless
+            pixels is given
+        dirty_box: the (x1, x2, y1, y2) area of image that changed
+        min_feature_size: the value the mesh was built with
+        pixels: new contents of the dirty area, written into image first
+
+    Returns:
+        The list of boxes taken out of the mesh and the list of boxes put in
+    """
+    if is_compact(mesh):
+        raise ValueError("update_mesh edits build_mesh meshes, expand compact meshes first")
+
+    x1, x2, y1, y2 = dirty_box
+    x1, x2 = max(0, x1), min(image.shape[0], x2)
+    y1, y2 = max(0, y1), min(image.shape[1], y2)
+    if x1 >= x2 or y1 >= y2:
+        return [], []
+    if pixels is not None:
+        image[x1:x2, y1:y2] = pixels
+
+    # Boxes crossing the border of the area are cut along it: the part inside is rebuilt with the rest of
+    # the area and the parts outside stay as boxes of their own, so the area never grows past the change
+    region = (x1, x2, y1, y2)
+    inside = [box for box in nm_pathfinder.boxes_near(region, mesh) if _overlaps(box, region)]
+
+    adj = mesh['adj']
+    removed = set(inside)
+    changed = set()
+    old_neighbors = {}
+    for box in inside:
+        old_neighbors[box] = adj.pop(box)
+        for neighbor in old_neighbors[box]:
+            if neighbor not in removed and neighbor in adj:
+                adj[neighbor] = [b for b in adj[neighbor] if b not in removed]
+                changed.add(neighbor)
+
+    added = {}
+    remainders = {}
+    for box in inside:
+        for part in _outside_parts(box, region):
+            remainders[part] = box
+            added[part] = []
+
+    # Rebuild the area as if it were a whole image of its own
+    levels, _ = _scan_levels(image, min_feature_size, region)
+    result = _merge_levels(levels, [])
+    new_boxes, new_edges = result if result is not None else ([], [])
+    for box in new_boxes:
+        added.setdefault(box, [])
+    for a, b in new_edges:
+        added[a].append(b)
+        added[b].append(a)
+
+    def link(a, b):
+        if b not in added[a]:
+            added[a].append(b)
+            if b in added:
+                added[b].append(a)
             else:
+                adj[b].append(a)
+                changed.add(b)
+
+    # A part left outside can only touch the old neighbors of its box, and the other new boxes
+    for part, box in remainders.items():
+        for other in old_neighbors[box]:
+            if other not in removed and _touches(part, other):
+                link(part, other)
+        for other in added:
+            if other != part and _touches(part, other):
+                link(part, other)
+
+    # Reconnect the rebuilt boxes to the boxes just outside, through the sides lying on the border of the area
+    outside = [box for box in nm_pathfinder.boxes_near((x1 - 1, x2 + 1, y1 - 1, y2 + 1), mesh)
+               if box not in removed and _touches(box, region)]
+    border = [box for box in new_boxes if box[0] == x1 or box[1] == x2 or box[2] == y1 or box[3] == y2]
+    for box in border:
+        for other in outside:
+            if _touches(box, other):
+                link(box, other)
+
+    adj.update(added)
+    nm_pathfinder.replace_boxes(mesh, inside, list(added))
+    if 'portals' in mesh:
+        for box in inside:
+            mesh['portals'].pop(box, None)
+        nm_pathfinder.add_portals(mesh, list(changed) + list(added))
+
+    mesh['version'] = mesh.get('version', 0) + 1
+
+    return inside, list(added)
+
+
+def _outside_parts(box, region):
+    # The up to four pieces of box lying outside region: whole-height strips on either side in x, then
+    # the pieces above and below region between them
+    bx1, bx2, by1, by2 = box
+    rx1, rx2, ry1, ry2 = region
+    parts = []
+    if bx1 < rx1:
+        parts.append((bx1, rx1, by1, by2))
+    if bx2 > rx2:
+        parts.append((rx2, bx2, by1, by2))
+    cx1, cx2 = max(bx1, rx1), min(bx2, rx2)
+    if by1 < ry1:
+        parts.append((cx1, cx2, by1, ry1))
+    if by2 > ry2:
+        parts.append((cx1, cx2, ry2, by2))
+    return parts
+
+
+def _overlaps(a, b):
+    return a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]
+
+
+def _touches(a, b):
+    # Sides on the same line that overlap or meet at a corner, as _merge_across links boxes
+    if a[1] == b[0] or b[1] == a[0]:
+        return a[2] <= b[3] and b[2] <= a[3]
+    if a[3] == b[2] or b[3] == a[2]:
+        return a[0] <= b[1] and b[0] <= a[1]
+    return False
+
+
+_tile_image = None
+_tile_min_feature_size = None
+
+
+def _init_tile_worker(image, min_feature_size):
+    global _tile_image, _tile_min_feature_size
+    _tile_image = image
+    _tile_min_feature_size = min_feature_size
+
+
+def _build_tile(box):
+    levels, _ = _scan_levels(_tile_image, _tile_min_feature_size, box)
+    return _merge_levels(levels, [])
+
+
+def _scan_levels(image, min_feature_size, root, stop_at=None):
+    # Scan the split tree under root top down. Every level keeps its boxes, which of them are whole
+    # walkable leaves, and for the ones that get split, the cut and the side of the box it runs along.
+    # The halves of the k-th split box are boxes 2k and 2k + 1 of the next level. With stop_at, scanning
+    # ends once a level holds that many boxes, and they are returned unscanned.
+    x0, _, y0, _ = root
+    sub_image = image[root[0]:root[1], root[2]:root[3]]
+
+    # Counts of walkable and of not-blocked pixels; they only differ on images with gray levels
+    if sub_image.dtype == bool:
+        walkable = open_pixels = integral_image(sub_image)
+    elif numpy.count_nonzero((sub_image != 0) & (sub_image != 255)):
+        walkable = integral_image(sub_image == 255)
+        open_pixels = integral_image(sub_image != 0)
+    else:
+        walkable = open_pixels = integral_image(sub_image == 255)
 
-                cut = int(y1 + (y2 - y1) / 2 + 1)
-                first_box = (x1, x2, y1, cut)
-                second_box = (x1, x2, cut, y2)
-
-                def rank(b): return (b[0], b[1])
+    def count(table, x1, x2, y1, y2):
+        x1, x2, y1, y2 = x1 - x0, x2 - x0, y1 - y0, y2 - y0
+        return (table[x2, y2].astype(numpy.int64) - table[x1, y2] - table[x2, y1] + table[x1, y1])
 
-                def first_touch(b): return b[3] == cut
+    levels = []
+    level = numpy.array([root], dtype=numpy.int64)
+    while len(level) and (stop_at is None or len(level) < stop_at):
+        x1, x2, y1, y2 = level.T
+        area = (x2 - x1) * (y2 - y1)
+        all_walkable = count(walkable, x1, x2, y1, y2) == area
+        all_blocked = count(open_pixels, x1, x2, y1, y2) == 0
+        split = ~((area < min_feature_size) | all_walkable | all_blocked | (area == 1))
+
+        # split this big box on the longest dimension. The usual cut lands on the far edge of boxes two
+        # pixels long, so those are halved instead.
+        x1, x2, y1, y2 = level[split].T
+        along_x = (x2 - x1) > (y2 - y1)
+        low = numpy.where(along_x, x1, y1)
+        length = numpy.where(along_x, x2 - x1, y2 - y1)
+        cut = numpy.where(length > 2, low + length // 2 + 1, low + 1)
+
+        halves = numpy.empty((2 * len(cut), 4), dtype=numpy.int64)
+        halves[0::2] = level[split]
+        halves[1::2] = level[split]
+        halves[0::2, 1] = numpy.where(along_x, cut, x2)
+        halves[1::2, 0] = numpy.where(along_x, cut, x1)
+        halves[0::2, 3] = numpy.where(along_x, y2, cut)
+        halves[1::2, 2] = numpy.where(along_x, y1, cut)
+
+        levels.append((level, all_walkable, split, cut, along_x))
+        level = halves
+
+    return levels, level
+
+
+def _merge_levels(levels, below):
+    # Merge bottom up, starting from the results for the boxes below the last level. A box's result only
+    # depends on its two halves, so each level can be finished before the one above it. Empty results are
+    # None.
+    for level, all_walkable, split, cuts, along_x in reversed(levels):
+        results = []
+        children = iter(below)
+        splits = iter(zip(cuts.tolist(), along_x.tolist()))
+        for box, leaf_walkable, is_split in zip(map(tuple, level.tolist()), all_walkable.tolist(), split.tolist()):
+            if not is_split:
+                # this box is simple enough to handle in one node
+                results.append(([box], []) if leaf_walkable else None)
+                continue
+            first, second = next(children), next(children)
+            cut, cut_along_x = next(splits)
+            if first is None or second is None:
+                # Nothing to merge with, so the other half passes through unchanged
+                results.append(second if first is None else first)
+            else:
+                results.append(_merge_across(first, second, cut, 1 if cut_along_x else 3))
+        below = results
 
-                def second_touch(b): return b[2] == cut
+    return below[0]
 
-            first_boxes, first_edges = scan(first_box)
-            second_boxes, second_edges = scan(second_box)
 
-            my_boxes = []
-            my_edges = []
+def _mesh_from_result(result):
+    boxes, edges = result if result is not None else ([], [])
 
-            my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
-            my_boxes.extend(
-                [sb for sb in second_boxes if not second_touch(sb)])
+    adj = collections.defaultdict(list)
+    for a, b in edges:
+        adj[a].append(b)
+        adj[b].append(a)
 
-            first_touches = sorted(filter(first_touch, first_boxes), key=rank)
-            second_touches = sorted(
-                filter(second_touch, second_boxes), key=rank)
+    mesh = {'boxes': list(adj.keys()), 'adj': dict(adj)}
 
-            first_merges = {}
-            second_merges = {}
+    return mesh
 
-            while first_touches and second_touches:
 
-                f, s = first_touches[0], second_touches[0]
-                rf, rs = rank(f), rank(s)
+def _merge_across(first, second, cut, end):
+    # Boxes of the first half end on the cut (coordinate end) and those of the second half start on it,
+    # ranked by their extent along the cut
+    start = end - 1
+    lo, hi = (2, 3) if end == 1 else (0, 1)
 
-                if rf == rs:
+    first_boxes, first_edges = first
+    second_boxes, second_edges = second
 
-                    first_touches.pop(0)
-                    second_touches.pop(0)
-                    merged = (f[0], s[1], f[2], s[3])
-                    first_merges[f] = merged
-                    second_merges[s] = merged
-                    my_boxes.append(merged)
+    my_boxes = [fb for fb in first_boxes if fb[end] != cut]
+    my_boxes.extend([sb for sb in second_boxes if sb[start] != cut])
+    my_edges = []
 
-                elif rf[1] < rs[1]:
+    first_touches = sorted([fb for fb in first_boxes if fb[end] == cut], key=lambda b: (b[lo], b[hi]))
+    second_touches = sorted([sb for sb in second_boxes if sb[start] == cut], key=lambda b: (b[lo], b[hi]))
 
-                    my_boxes.append(first_touches.pop(0))
-                    if rf[1] >= rs[0]:
-                        my_edges.append((f, s))
+    first_merges = {}
+    second_merges = {}
 
-                elif rf[1] > rs[1]:
+    i = j = 0
+    while i < len(first_touches) and j < len(second_touches):
 
-                    my_boxes.append(second_touches.pop(0))
-                    if rf[0] <= rs[1]:
-                        my_edges.append((f, s))
+        f, s = first_touches[i], second_touches[j]
+        rf, rs = (f[lo], f[hi]), (s[lo], s[hi])
 
-                else:
+        if rf == rs:
 
-                    my_boxes.append(first_touches.pop(0))
-                    my_boxes.append(second_touches.pop(0))
-                    my_edges.append((f, s))
+            i += 1
+            j += 1
+            merged = (f[0], s[1], f[2], s[3])
+            first_merges[f] = merged
+            second_merges[s] = merged
+            my_boxes.append(merged)
 
-            my_boxes.extend(first_touches)
-            my_boxes.extend(second_touches)
+        elif rf[1] < rs[1]:
 
-            for a, b in first_edges:
-                my_edges.append(
-                    (first_merges.get(a, a), first_merges.get(b, b)))
+            i += 1
+            my_boxes.append(f)
+            if rf[1] >= rs[0]:
+                my_edges.append((f, s))
 
-            for a, b in second_edges:
-                my_edges.append(
-                    (second_merges.get(a, a), second_merges.get(b, b)))
+        elif rf[1] > rs[1]:
 
-            return my_boxes, my_edges
+            j += 1
+            my_boxes.append(s)
+            if rf[0] <= rs[1]:
+                my_edges.append((f, s))
 
-            # end of scan
+        else:
 
-    boxes, edges = scan((0, image.shape[0], 0, image.shape[1]))
+            i += 1
+            j += 1
+            my_boxes.append(f)
+            my_boxes.append(s)
+            my_edges.append((f, s))
 
-    adj = collections.defaultdict(list)
-    for a, b in edges:
-        adj[a].append(b)
-        adj[b].append(a)
+    my_boxes.extend(first_touches[i:])
+    my_boxes.extend(second_touches[j:])
 
-    mesh = {'boxes': list(adj.keys()), 'adj': dict(adj)}
+    # Edges from below keep their order; only ends that were just merged change
+    for merges, edges in ((first_merges, first_edges), (second_merges, second_edges)):
+        if merges:
+            my_edges.extend([(merges.get(a, a), merges.get(b, b)) for a, b in edges])
+        else:
+            my_edges.extend(edges)
 
-    return mesh
+    return my_boxes, my_edges
 
 
 if __name__ == '__main__':
 
     min_feature_size = 16
     filename = None
+    mesh_format = 'pickle'
 
     if len(sys.argv) == 2:
         filename = sys.argv[1]
-    elif len(sys.argv) == 3:
+    elif len(sys.argv) in (3, 4):
         filename = sys.argv[1]
         min_feature_size = int(sys.argv[2])
-    else:
-        print("usage: %s map_filename min_feature_size" % sys.argv[0])
+        if len(sys.argv) == 4:
+            mesh_format = sys.argv[3]
+    if filename is None or mesh_format not in ('pickle', 'binary'):
+        print("usage: %s map_filename min_feature_size [pickle|binary]" % sys.argv[0])
         sys.exit(-1)
 
-    img = (imread(filename) * 255).astype(dtype=numpy.uint8)
-    if len(img.shape) > 2:
-        img = img[:, :, 0]
+    mask = load_walkable_mask(filename)
 
-    mesh = build_mesh(img, min_feature_size)
+    mesh = build_mesh(mask, min_feature_size)
+    nm_pathfinder.add_portals(mesh)
 
     print(type(mesh))
     print(mesh.keys())
 
-    with open(filename + '.mesh.pickle', 'wb') as f:
-        pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
+    if mesh_format == 'binary':
+        save_mesh_file(mesh, filename + '.mesh.bin')
+    else:
+        with open(filename + '.mesh.pickle', 'wb') as f:
+            pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
 
-    atlas = zeros_like(img)
+    atlas = numpy.zeros(mask.shape, dtype=numpy.uint8)
     for x1, x2, y1, y2 in mesh['boxes']:
         atlas[x1:x2, y1:y2] = random.randint(64, 255)
 
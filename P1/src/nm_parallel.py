@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+
+import nm_pathfinder
+
+# The mesh each worker process answers queries against
+_worker_mesh = None
+
+
+def _init_worker(mesh):
+    global _worker_mesh
+    _worker_mesh = mesh
+
+
+def _run_chunk(chunk):
+    algorithm, queries = chunk
+    return nm_pathfinder.find_paths(queries, _worker_mesh, algorithm)
+
+
+def _pool_context():
+    # Under fork the workers share the data of this process, a mesh or an image, instead of receiving
+    # a pickled copy each
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def make_query_pool(mesh, processes=None):
+    """
+    Starts worker processes that each hold a copy of mesh for answering queries
+
+    With the fork start method (the default on Linux) the workers inherit the mesh from this process,
+    so it is never pickled. Elsewhere it is pickled once per worker, never once per query.
+
+    Args:
+        mesh: pathway constraints the paths adhere to
+        processes: number of workers, defaults to the number of cores
+
+    Returns:
+        A multiprocessing Pool to pass to find_paths_parallel
+    """
+    # Build the point index before starting the workers so they all inherit it
+    nm_pathfinder.box_index(mesh)
+
+    return _pool_context().Pool(processes, initializer=_init_worker, initargs=(mesh,))
+
+
+def find_paths_parallel(queries, mesh, algorithm='regular', processes=None, pool=None):
+    """
+    Searches for a path for every (source_point, destination_point) pair in queries, spread across cores
+
+    Args:
+        queries: iterable of (source_point, destination_point) pairs
+        mesh: pathway constraints the paths adhere to
+        algorithm: name of the search to run, a key of nm_pathfinder.ALGORITHMS
+        processes: number of workers when no pool is given, defaults to the number of cores
+        pool: a pool from make_query_pool for this same mesh, reused instead of starting a new one
+
+    Returns:
+        A list with one (path, explored boxes) pair per query, in the order given
+    """
+    if algorithm not in nm_pathfinder.ALGORITHMS:
+        raise ValueError("Unknown algorithm %r, expected one of %s"
+                         % (algorithm, ', '.join(nm_pathfinder.ALGORITHMS)))
+
+    queries = list(queries)
+    if not queries:
+        return []
+
+    own_pool = pool is None
+    if own_pool:
+        pool = make_query_pool(mesh, processes)
+
+    try:
+        # A few chunks per worker keeps them busy when some queries run long
+        workers = processes or os.cpu_count() or 1
+        chunk_size = max(1, len(queries) // (workers * 4))
+        chunks = [(algorithm, queries[i:i + chunk_size]) for i in range(0, len(queries), chunk_size)]
+
+        results = []
+        for chunk_results in pool.map(_run_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
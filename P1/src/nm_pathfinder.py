@@ -1,8 +1,17 @@
+from collections import deque
 from queue import Queue
 from heapq import heappush, heappop
+import logging
 import math
+import time
 
-def find_path(source_point, destination_point, mesh):
+import numpy
+
+from nm_compact import CompactGraph, is_compact
+
+logger = logging.getLogger(__name__)
+
+def find_path(source_point, destination_point, mesh, algorithm='regular', stats=None, smooth=False):
     """
     Searches for a path from source_point to destination_point through the mesh
 
@@ -10,240 +19,903 @@ def find_path(source_point, destination_point, mesh):
         source_point: starting point of the pathfinder
         destination_point: the ultimate goal the pathfinder must reach
         mesh: pathway constraints the path adheres to
+        algorithm: name of the search to run, a key of ALGORITHMS
+        stats: a SearchStats to fill in with the counters and timings of this query
+        smooth: pull the path taut through the boxes it passes with funnel_path
 
     Returns:
         A path (list of points) from source_point to destination_point if exists
         A list of boxes explored by the algorithm
     """
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unknown algorithm %r, expected one of %s" % (algorithm, ', '.join(ALGORITHMS)))
+
+    if smooth:
+        path, explored, _ = find_corridor(source_point, destination_point, mesh, algorithm, stats, smooth)
+        return path, explored
+    return ALGORITHMS[algorithm](source_point, destination_point, mesh, stats)
+
+def find_paths(queries, mesh, algorithm='regular'):
+    """
+    Searches for a path for every (source_point, destination_point) pair in queries through the same mesh
+
+    Args:
+        queries: iterable of (source_point, destination_point) pairs
+        mesh: pathway constraints the paths adhere to
+        algorithm: name of the search to run, a key of ALGORITHMS
+
+    Returns:
+        A list with one (path, explored boxes) pair per query, in the order given
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unknown algorithm %r, expected one of %s" % (algorithm, ', '.join(ALGORITHMS)))
+    search = ALGORITHMS[algorithm]
+
+    # Build the point index up front so every query in the batch shares it
+    box_index(mesh)
+
+    return [search(source_point, destination_point, mesh) for source_point, destination_point in queries]
+
+def find_corridor(source_point, destination_point, mesh, algorithm='regular', stats=None, smooth=False):
+    """
+    Searches like find_path, and also returns the boxes the path passes through
+
+    Args:
+        source_point: starting point of the pathfinder
+        destination_point: the ultimate goal the pathfinder must reach
+        mesh: pathway constraints the path adheres to
+        algorithm: name of the search to run, a key of ALGORITHMS
+        stats: a SearchStats to fill in with the counters and timings of this query
+        smooth: pull the path taut through the corridor with funnel_path
+
+    Returns:
+        A path (list of points) from source_point to destination_point if exists
+        A list of boxes explored by the algorithm
+        The corridor, a list of boxes from the source box to the destination box, empty if no path exists
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unknown algorithm %r, expected one of %s" % (algorithm, ', '.join(ALGORITHMS)))
+
+    path, explored, corridor = _run_search(_CORRIDOR_SEARCHES[algorithm], algorithm, source_point,
+                                           destination_point, mesh, stats)
+    if smooth and corridor:
+        started = time.perf_counter()
+        path = funnel_path(source_point, destination_point, corridor)
+        if stats is not None:
+            stats.timings['smooth'] = time.perf_counter() - started
+    return path, explored, corridor
+
+def corridor_path(source_point, destination_point, corridor):
+    """
+    Rebuilds the detail points of a path through a known corridor for new endpoints
+
+    Args:
+        source_point: starting point, inside the first box of the corridor
+        destination_point: end point, inside the last box of the corridor
+        corridor: list of boxes from the source box to the destination box
+
+    Returns:
+        The path (list of points) through the corridor, entering each box at the point closest to the last one
+    """
+    path = [source_point]
+    for box in corridor[1:]:
+        path.append(constrain_point_to_box(path[-1], box))
+    path.append(destination_point)
+    return path
+
+def funnel_path(source_point, destination_point, corridor):
+    """
+    Finds the shortest path through a corridor of boxes by pulling it taut across their shared borders
 
-    search_choice = input("Enter 1 for Regular A* or 2 for Bidirectional A*: ")
+    The funnel of straight lines from the last corner of the path is narrowed portal by portal, and a
+    new corner is added wherever one side of the funnel crosses the other. Each portal end enters and
+    leaves the funnel once, so the running time is linear in the length of the corridor.
 
-    if search_choice == "1":
-        return regular_a_star(source_point, destination_point, mesh)
-    elif search_choice == "2":
-        return bidirectional_a_star(source_point, destination_point, mesh)
+    Args:
+        source_point: starting point, inside the first box of the corridor
+        destination_point: end point, inside the last box of the corridor
+        corridor: list of boxes from the source box to the destination box
+
+    Returns:
+        The path (list of points), turning only at corners of the corridor
+    """
+    # The funnel holds its left side (newest point first), the apex, then its right side (newest last)
+    funnel = deque([source_point])
+    apex = 0
+    path = [source_point]
+
+    def add_left(point):
+        nonlocal apex
+        while apex > 0 and _cross(funnel[1], funnel[0], point) <= 0:
+            funnel.popleft()
+            apex -= 1
+        if apex == 0:
+            # Past the right side, so the path bends around its corners
+            while len(funnel) > 1 and _cross(funnel[0], funnel[1], point) < 0:
+                funnel.popleft()
+                path.append(funnel[0])
+        funnel.appendleft(point)
+        apex += 1
+
+    def add_right(point):
+        nonlocal apex
+        while apex < len(funnel) - 1 and _cross(funnel[-2], funnel[-1], point) >= 0:
+            funnel.pop()
+        if apex == len(funnel) - 1:
+            # Past the left side, so the path bends around its corners
+            while len(funnel) > 1 and _cross(funnel[-1], funnel[-2], point) > 0:
+                funnel.pop()
+                path.append(funnel[-1])
+            apex = len(funnel) - 1
+        funnel.append(point)
+
+    for box, next_box in zip(corridor, corridor[1:]):
+        left, right = _portal_ends(box, next_box)
+        if left != funnel[0]:
+            add_left(left)
+        if right != funnel[-1]:
+            add_right(right)
+
+    # The rest of the way runs along the left side to the destination
+    add_left(destination_point)
+    path.extend(funnel[i] for i in range(apex - 1, -1, -1))
+    return path
+
+def _cross(origin, a, b):
+    # Positive when b lies to the left of the line from origin through a
+    return (a[0] - origin[0]) * (b[1] - origin[1]) - (a[1] - origin[1]) * (b[0] - origin[0])
+
+def _portal_ends(box, next_box):
+    # The ends of the shared border as seen crossing from box into next_box, left end first
+    x1, x2, y1, y2 = portal_between(box, next_box)
+    if x1 == x2 and y1 != y2:
+        # Crossing along x
+        if next_box[0] == x1:
+            return (x1, y2), (x1, y1)
+        if next_box[1] == x1:
+            return (x1, y1), (x1, y2)
+    elif y1 == y2 and x1 != x2:
+        # Crossing along y
+        if next_box[2] == y1:
+            return (x1, y1), (x2, y1)
+        if next_box[3] == y1:
+            return (x2, y1), (x1, y1)
+    # A corner, or boxes that overlap instead of touching: squeeze through the middle
+    middle = ((x1 + x2) / 2, (y1 + y2) / 2)
+    return middle, middle
+
+def in_box(point, box):
+    x1, x2, y1, y2 = box
+    x, y = point
+    return x1 <= x < x2 and y1 <= y < y2
+
+def build_box_index(mesh):
+    """
+    Buckets the boxes of a mesh into a uniform grid so points can be located without scanning every box
+
+    Args:
+        mesh: pathway constraints the path adheres to
+
+    Returns:
+        A dict with the grid 'cell_size' and 'cells', mapping each grid cell to the boxes overlapping it
+    """
+    # Compact meshes are indexed by box id, the others by the box itself
+    if is_compact(mesh):
+        entries = list(enumerate(map(tuple, mesh['boxes'].tolist())))
     else:
-        print("Invalid choice. Please enter 1 or 2.")
-        return [], []
+        entries = [(box, box) for box in mesh['boxes']]
+    if not entries:
+        return {'cell_size': 1, 'cells': {}}
 
-def regular_a_star(source_point, destination_point, mesh):
-    path = []
-    boxes = {}
-    detail_points = {}
-
-    source_box = None
-    destination_box = None
-
-    # Extract boxes from mesh
-    all_boxes = mesh['boxes']
-
-    # Check if box holds point
-    def in_box(point, box):
-        x1, x2, y1, y2 = box
-        x, y = point
-        return x1 <= x < x2 and y1 <= y < y2
-
-    # Constrain point to box
-    def constrain_point_to_box(point, box):
-        x1, x2, y1, y2 = box
-        x, y = point
-        constrained_x = max(x1, min(x, x2))
-        constrained_y = max(y1, min(y, y2))
-        return (constrained_x, constrained_y)
-
-    # Iterating through list of boxes to find which boxes have the source and destination points
-    for box in all_boxes:
-        if in_box(source_point, box):  # Check if point is in box
-            source_box = box  # Save box to source_box
-            detail_points[box] = source_point
-            boxes[box] = True  # Mark box as searched
-        if in_box(destination_point, box):
-            destination_box = box  # Same thing for destination
-            detail_points[box] = destination_point
-            boxes[box] = True
-
-    # Check if boxes found and print if not found
-    if source_box is None or destination_box is None:
-        print("No source and/or No destination point found")
-        return [], list(boxes.keys())
-
-    print(f"Source point: {source_point}")
-    print(f"Destination point: {destination_point}")
-
-    # Heuristic function (Euclidean distance)
-    def heuristic(point1, point2):
-        return math.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
-
-    # Priority queue for the frontier
-    frontier = []
-    heappush(frontier, (0, source_box))
-
-    # Distance map and previous map for path reconstruction
-    g_score = {source_box: 0}
-    came_from = {source_box: None}
-
-    while frontier:
-        _, current = heappop(frontier)
-
-        # If destination is reached, reconstruct the path
-        if current == destination_box:
-            while current is not None:
-                path.append(detail_points[current])
-                current = came_from[current]
-            path.reverse()
-            path.append(destination_point)
-            return path, list(detail_points.keys())
-
-        # Explore neighbors
-        for neighbor in mesh['adj'][current]:
-            neighbor_point = constrain_point_to_box(detail_points[current], neighbor)
-            tentative_g_score = g_score[current] + heuristic(detail_points[current], neighbor_point)
-
-            if neighbor not in g_score or tentative_g_score < g_score[neighbor]:
-                g_score[neighbor] = tentative_g_score
-                came_from[neighbor] = current
-                detail_points[neighbor] = neighbor_point
-                f_score = tentative_g_score + heuristic(neighbor_point, destination_point)
-                heappush(frontier, (f_score, neighbor))
-
-    # If no path is found
-    print("No path found!")
-    return [], list(detail_points.keys())
-
-def bidirectional_a_star(source_point, destination_point, mesh):
-    path = []
-    boxes = {}
-    detail_points = {}
-
-    source_box = None
-    destination_box = None
-
-    # Extract boxes from mesh
-    all_boxes = mesh['boxes']
-
-    # Check if point in box
-    def in_box(point, box):
-        x1, x2, y1, y2 = box
-        x, y = point
-        return x1 <= x < x2 and y1 <= y < y2
-
-    # Constrain points to box
-    def constrain_point_to_box(point, box):
-        x1, x2, y1, y2 = box
-        x, y = point
-        constrained_x = max(x1, min(x, x2))
-        constrained_y = max(y1, min(y, y2))
-        return (constrained_x, constrained_y)
-
-    # Iterating through list of boxes to find which boxes have the source and destination points
-    for box in all_boxes:
-        if in_box(source_point, box):  # Check if point is in box
-            source_box = box  # Save box to source_box
-            detail_points[box] = source_point
-            boxes[box] = True  # Mark box as searched
-        if in_box(destination_point, box):
-            destination_box = box  # Same thing for destination
-            detail_points[box] = destination_point
-            boxes[box] = True
-
-    # Check if boxes found and print if not found
-    if source_box is None or destination_box is None:
-        print("No source and/or No destination point found")
-        return [], list(boxes.keys())
+    # Size cells so there are about as many cells as boxes
+    total_area = sum((x2 - x1) * (y2 - y1) for _, (x1, x2, y1, y2) in entries)
+    cell_size = max(1, math.sqrt(total_area / len(entries)))
 
-    print(f"Source point: {source_point}")
-    print(f"Destination point: {destination_point}")
+    cells = {}
+    for node, box in entries:
+        for cell in _grid_cells(box, cell_size):
+            cells.setdefault(cell, []).append(node)
 
-    # Check if the two points are in the same box
-    if source_box == destination_box:
-        return [source_point, destination_point], [source_box]
+    return {'cell_size': cell_size, 'cells': cells}
+
+
+def replace_boxes(mesh, removed, added):
+    """
+    Takes boxes out of mesh['boxes'] and puts others in, keeping the box index up to date
 
-    # Heuristic function (Euclidean distance)
-    def heuristic(point1, point2):
-        return math.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
+    Only the grid cells the changed boxes overlap are touched, and boxes leave the list by swapping in
+    its last box, so the work does not grow with the size of the mesh. The order of mesh['boxes'] changes.
 
-    # Frontier for both directions
-    forward_frontier = []
-    backward_frontier = []
+    Args:
+        mesh: pathway constraints the path adheres to, a build_mesh mesh
+        removed: boxes to take out
+        added: boxes to put in
+    """
+    index = box_index(mesh)
+    boxes = mesh['boxes']
+    if 'slots' not in index:
+        index['slots'] = {box: i for i, box in enumerate(boxes)}
+    slots = index['slots']
+    for box in removed:
+        i = slots.pop(box)
+        last = boxes.pop()
+        if i < len(boxes):
+            boxes[i] = last
+            slots[last] = i
+    for box in added:
+        slots[box] = len(boxes)
+        boxes.append(box)
+
+    cells = index['cells']
+    cell_size = index['cell_size']
+    for box in removed:
+        for cell in _grid_cells(box, cell_size):
+            cell_boxes = cells.get(cell)
+            if cell_boxes is not None and box in cell_boxes:
+                cell_boxes.remove(box)
+                if not cell_boxes:
+                    del cells[cell]
+    for box in added:
+        for cell in _grid_cells(box, cell_size):
+            cells.setdefault(cell, []).append(box)
+
+
+def boxes_near(box, mesh):
+    """
+    Lists the boxes of the mesh whose grid cells overlap box, a superset of the boxes overlapping it
 
-    heappush(forward_frontier, (0, source_box))
-    heappush(backward_frontier, (0, destination_box))
+    Args:
+        box: the (x1, x2, y1, y2) area to look around
+        mesh: pathway constraints the path adheres to
 
-    # Distance maps for both directions
-    forward_dist = {source_box: 0}
-    backward_dist = {destination_box: 0}
+    Returns:
+        The boxes (ids for a compact mesh) found, each once
+    """
+    index = box_index(mesh)
+    cells = index['cells']
+    found = {}
+    for cell in _grid_cells(box, index['cell_size']):
+        for node in cells.get(cell, ()):
+            found[node] = True
+    return list(found)
+
+
+def _grid_cells(box, cell_size):
+    x1, x2, y1, y2 = box
+    first_cx, first_cy = int(x1 // cell_size), int(y1 // cell_size)
+    last_cx = max(first_cx, math.ceil(x2 / cell_size) - 1)
+    last_cy = max(first_cy, math.ceil(y2 / cell_size) - 1)
+    for cx in range(first_cx, last_cx + 1):
+        for cy in range(first_cy, last_cy + 1):
+            yield cx, cy
+
+def box_index(mesh):
+    # Built once per mesh and kept alongside it
+    if 'index' not in mesh:
+        mesh['index'] = build_box_index(mesh)
+    return mesh['index']
+
+def locate_box(point, mesh):
+    """
+    Finds the box of the mesh holding point
 
-    # Previous pointers for path reconstruction
-    forward_prev = {source_box: None}
-    backward_prev = {destination_box: None}
+    Args:
+        point: the point to look up
+        mesh: pathway constraints the path adheres to
 
+    Returns:
+        The box containing point (its id for a compact mesh), or None if point is outside every box
+    """
+    index = box_index(mesh)
+    graph = mesh_graph(mesh)
+    cell_size = index['cell_size']
+    cell = (int(point[0] // cell_size), int(point[1] // cell_size))
+    # Later boxes win, matching a front-to-back scan of mesh['boxes']
+    for node in reversed(index['cells'].get(cell, ())):
+        if in_box(point, graph.box(node)):
+            return node
+    return None
+
+class _Scores(dict):
+    # Boxes not reached yet are infinitely far away
+    def __missing__(self, key):
+        return math.inf
+
+class _Flags(dict):
+    # Boxes start out unmarked
+    def __missing__(self, key):
+        return False
+
+class _DictGraph:
+    """
+    Search view of a mesh from build_mesh: nodes are the box tuples themselves and buffers are dicts
+    """
+
+    no_node = None
+
+    def __init__(self, mesh):
+        self.adj = mesh['adj']
+        self.portals = mesh.get('portals')
+
+    def nodes(self):
+        return list(self.adj)
+
+    def box(self, node):
+        return node
+
+    def neighbors(self, node):
+        return self.adj[node]
+
+    def edges(self, node):
+        # Without stored portals the neighbor box stands in, which constrains points of node the same way
+        if self.portals is None:
+            return zip(self.adj[node], self.adj[node])
+        return zip(self.adj[node], self.portals[node])
+
+    def scores(self):
+        return _Scores()
+
+    def parents(self):
+        return {}
+
+    def points(self):
+        return {}
+
+    def flags(self):
+        return _Flags()
+
+    def release(self, points, scores=None, parents=None, flags=None):
+        pass  # Dict buffers are simply dropped
+
+    def explored(self, points):
+        return list(points.keys())
+
+def mesh_graph(mesh):
+    """
+    Wraps a mesh in either format with the node and buffer operations the searches need
+
+    Args:
+        mesh: a mesh from build_mesh or a compact mesh from nm_compact
+
+    Returns:
+        A graph view with nodes, box, neighbors, edges, scores, parents, points, flags, release and explored
+        methods. The view of a compact mesh is built once and kept with it.
+    """
+    if is_compact(mesh):
+        if 'graph' not in mesh:
+            mesh['graph'] = CompactGraph(mesh)
+        return mesh['graph']
+    return _DictGraph(mesh)
+
+# Constrain point to box
+def constrain_point_to_box(point, box):
+    x1, x2, y1, y2 = box
+    x, y = point
+    constrained_x = max(x1, min(x, x2))
+    constrained_y = max(y1, min(y, y2))
+    return (constrained_x, constrained_y)
+
+# Shared border of two adjacent boxes, as a degenerate box so points can be constrained to it
+def portal_between(box_a, box_b):
+    ax1, ax2, ay1, ay2 = box_a
+    bx1, bx2, by1, by2 = box_b
+    portal = (max(ax1, bx1), min(ax2, bx2), max(ay1, by1), min(ay2, by2))
+    if portal[0] > portal[1] or portal[2] > portal[3]:
+        return box_b  # Not touching, so the best we can do is the whole neighbor
+    return portal
+
+def add_portals(mesh, boxes=None):
+    """
+    Precomputes the shared border of every pair of neighboring boxes and stores it with the mesh
+
+    The searches then constrain entry points to the stored portal instead of fetching the neighbor box
+    on every relaxation. A mesh from build_mesh gets mesh['portals'], mapping each box to the portals of
+    its neighbors in mesh['adj'] order. A compact mesh gets a 'portal_boxes' array with one row per entry
+    of adj_indices, which save_mesh_file writes out with the rest of the mesh.
+
+    Args:
+        mesh: pathway constraints the path adheres to
+        boxes: for a build_mesh mesh, recompute only the portals of these boxes, after their neighbors changed
+    """
+    if is_compact(mesh):
+        box_array = mesh['boxes']
+        owners = numpy.repeat(numpy.arange(len(box_array)), numpy.diff(mesh['adj_offsets']))
+        a, b = box_array[owners], box_array[mesh['adj_indices']]
+        portals = numpy.empty_like(b)
+        portals[:, 0::2] = numpy.maximum(a[:, 0::2], b[:, 0::2])
+        portals[:, 1::2] = numpy.minimum(a[:, 1::2], b[:, 1::2])
+        apart = (portals[:, 0] > portals[:, 1]) | (portals[:, 2] > portals[:, 3])
+        portals[apart] = b[apart]
+        mesh['portal_boxes'] = portals
+        mesh.pop('graph', None)  # Built without the portals
+        return
+
+    adj = mesh['adj']
+    portals = mesh.setdefault('portals', {})
+    for box in adj if boxes is None else boxes:
+        portals[box] = [portal_between(box, neighbor) for neighbor in adj[box]]
+
+# Heuristic function (Euclidean distance)
+def heuristic(point1, point2):
+    return math.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
+
+def regular_a_star(source_point, destination_point, mesh, stats=None):
+    path, explored, _ = _run_search(_regular_a_star, 'regular', source_point, destination_point, mesh, stats)
+    return path, explored
+
+def _regular_a_star(source_point, destination_point, mesh, stats):
+    # A search run in one installment with no budget
+    search = SearchHandle(source_point, destination_point, mesh, stats)
+    path, explored, _ = search.run()
+    return path, explored, search.corridor
+
+def bidirectional_a_star(source_point, destination_point, mesh, stats=None):
+    path, explored, _ = _run_search(_bidirectional_a_star, 'bidirectional', source_point, destination_point, mesh,
+                                    stats)
+    return path, explored
+
+def _bidirectional_a_star(source_point, destination_point, mesh, stats):
+    started = time.perf_counter()
+    path = []
+    corridor = []
+    boxes = {}
+    graph = mesh_graph(mesh)
+
+    # Look up which boxes hold the source and destination points
+    source_box = locate_box(source_point, mesh)
+    if source_box is not None:
+        boxes[source_box] = True  # Mark box as searched
+    destination_box = locate_box(destination_point, mesh)
+    if destination_box is not None:
+        boxes[destination_box] = True
+    located = time.perf_counter()
+    if stats is not None:
+        stats.timings['locate'] = located - started
+
+    # Check if boxes found and log if not found
+    if source_box is None or destination_box is None:
+        logger.debug("No source and/or no destination box found for %s -> %s", source_point, destination_point)
+        return [], [graph.box(box) for box in boxes], []
+
+    logger.debug("Searching from %s to %s", source_point, destination_point)
+
+    # Check if the two points are in the same box
+    if source_box == destination_box:
+        return [source_point, destination_point], [graph.box(source_box)], [graph.box(source_box)]
+
+    # Each direction keeps its own frontier, distances, previous pointers, entry points and closed set.
+    # Both order their frontier by the same balanced potential, half the difference of the distances to
+    # the two ends: (h(v, destination) - h(v, source)) / 2 forward and its negation backward. The
+    # potentials of the two sides add up to zero everywhere, so the search can stop as soon as the two
+    # smallest priorities together reach the cheapest meeting found, instead of waiting for either side
+    # alone to reach it. Any order of expansion keeps that test exact, so the side with the smaller
+    # frontier goes next. Frontier entries carry the push count, so ties come out in push order.
+    half = heuristic(source_point, destination_point) / 2
+    forward_frontier, backward_frontier = [(half, 0, source_box)], [(half, 1, destination_box)]
+    forward_dist, backward_dist = graph.scores(), graph.scores()
+    forward_prev, backward_prev = graph.parents(), graph.parents()
+    forward_points, backward_points = graph.points(), graph.points()
+    forward_closed, backward_closed = graph.flags(), graph.flags()
+
+    forward_dist[source_box] = 0
+    forward_prev[source_box] = graph.no_node
+    forward_points[source_box] = source_point
+    backward_dist[destination_box] = 0
+    backward_prev[destination_box] = graph.no_node
+    backward_points[destination_box] = destination_point
+
+    forward = (forward_frontier, forward_dist, forward_prev, forward_points, forward_closed,
+               destination_point, source_point)
+    backward = (backward_frontier, backward_dist, backward_prev, backward_points, backward_closed,
+                source_point, destination_point)
+
+    on_expand = stats.on_expand if stats is not None else None
+    pushes = 2
+    pops = stale_pops = expanded = scanned = relaxed = 0
+
+    # Cheapest known path: forward to the meeting box, across it, then backward to the destination
+    best_cost = math.inf
     meeting_box = None
 
     # Bidirectional A* Search
     while forward_frontier and backward_frontier:
-        # Expand forward frontier
-        _, current_forward = heappop(forward_frontier)
+        # No path through unexpanded boxes can be cheaper than the best meeting found so far
+        if forward_frontier[0][0] + backward_frontier[0][0] >= best_cost:
+            break
 
-        for neighbor in mesh['adj'][current_forward]:
+        # Expand the side with the smaller frontier
+        if len(forward_frontier) <= len(backward_frontier):
+            side, other = forward, backward
+        else:
+            side, other = backward, forward
+        frontier, dist, prev, points, closed, (tx, ty), (ax, ay) = side
+        other_dist, other_points = other[1], other[3]
+
+        _, _, current = heappop(frontier)
+        pops += 1
+        if closed[current]:
+            stale_pops += 1
+            continue  # Stale entry for a box already expanded
+        closed[current] = True
+
+        expanded += 1
+        current_point = points[current]
+        current_dist = dist[current]
+        if on_expand is not None:
+            on_expand(graph.box(current), current_point, current_dist)
+
+        x, y = current_point
+        for neighbor, portal in graph.edges(current):
+            if closed[neighbor]:
+                continue
+
+            scanned += 1
+            px1, px2, py1, py2 = portal
+            nx, ny = max(px1, min(x, px2)), max(py1, min(y, py2))
+            tentative_dist = current_dist + math.sqrt((x - nx) ** 2 + (y - ny) ** 2)
+
+            if tentative_dist < dist[neighbor]:
+                relaxed += 1
+                dist[neighbor] = tentative_dist
+                prev[neighbor] = current
+                points[neighbor] = neighbor_point = (nx, ny)
+
+                # The other side has reached this box too, so the two halves can be joined inside it
+                if neighbor in other_points:
+                    cost = tentative_dist + heuristic(neighbor_point, other_points[neighbor]) + other_dist[neighbor]
+                    if cost < best_cost:
+                        best_cost = cost
+                        meeting_box = neighbor
 
-            if neighbor not in boxes:
-                neighbor_point = constrain_point_to_box(detail_points[current_forward], neighbor)
-                tentative_dist = forward_dist[current_forward] + heuristic(detail_points[current_forward], neighbor_point)
+                # Not worth expanding if even a straight line on from here cannot beat the best meeting
+                to_end = math.sqrt((nx - tx) ** 2 + (ny - ty) ** 2)
+                if tentative_dist + to_end < best_cost:
+                    heappush(frontier, (tentative_dist + (to_end - math.sqrt((nx - ax) ** 2 + (ny - ay) ** 2)) / 2,
+                                        pushes, neighbor))
+                    pushes += 1
+    searched = time.perf_counter()
 
-                if neighbor not in forward_dist or tentative_dist < forward_dist[neighbor]:
-                    forward_dist[neighbor] = tentative_dist
-                    forward_prev[neighbor] = current_forward
-                    detail_points[neighbor] = neighbor_point
-                    heappush(forward_frontier, (tentative_dist + heuristic(neighbor_point, destination_point), neighbor))
+    explored = list(dict.fromkeys(graph.explored(forward_points) + graph.explored(backward_points)))
 
-                    if neighbor in backward_prev:
-                        meeting_box = neighbor
-                        break
+    # Check if meeting box was found
+    if meeting_box is None:
+        logger.debug("No path found from %s to %s", source_point, destination_point)
+    else:
+        # Reconstruct path from source to meet box
+        current = meeting_box
+        while current != graph.no_node:
+            path.append(forward_points[current])
+            corridor.append(graph.box(current))
+            current = forward_prev[current]
+        path.reverse()
+        corridor.reverse()
+
+        # Then from the meet box on to the destination
+        current = meeting_box
+        while current != graph.no_node:
+            if backward_points[current] != path[-1]:
+                path.append(backward_points[current])
+            if current != meeting_box:
+                corridor.append(graph.box(current))
+            current = backward_prev[current]
+
+    graph.release(forward_points, forward_dist, forward_prev, forward_closed)
+    graph.release(backward_points, backward_dist, backward_prev, backward_closed)
+
+    if stats is not None:
+        stats.add_counts(pushes=pushes, pops=pops, stale_pops=stale_pops, expanded=expanded, scanned=scanned,
+                         relaxed=relaxed)
+        stats.timings['search'] = searched - located
+        stats.timings['reconstruct'] = time.perf_counter() - searched
+    return path, explored, corridor
+
+def start_search(source_point, destination_point, mesh, stats=None):
+    """
+    Begins a regular A* search that runs in installments, for callers with a budget per frame
 
-        if meeting_box:
-            break
+    Args:
+        source_point: starting point of the pathfinder
+        destination_point: the ultimate goal the pathfinder must reach
+        mesh: pathway constraints the path adheres to
+        stats: a SearchStats to fill in with the counters and timings of all installments together
+
+    Returns:
+        A SearchHandle; nothing is expanded until its run method is called
+    """
+    if stats is None and _query_hooks:
+        stats = SearchStats()
+    if stats is not None:
+        stats.algorithm = 'budgeted'
+        stats.source_point = source_point
+        stats.destination_point = destination_point
+    return SearchHandle(source_point, destination_point, mesh, stats, report=True)
+
+def budgeted_a_star(source_point, destination_point, mesh, max_expansions=None, time_limit=None, stats=None):
+    """
+    Searches like regular_a_star, giving up once it has expanded max_expansions boxes or spent time_limit seconds
+
+    Returns:
+        A path (list of points) to destination_point if one was found, otherwise the best partial path
+        A list of boxes explored by the algorithm
+        Whether the search finished; if not, the path ends in the frontier box estimated closest to the goal
+    """
+    deadline = time.perf_counter() + time_limit if time_limit is not None else None
+    return start_search(source_point, destination_point, mesh, stats).run(max_expansions, deadline)
 
-        # Expand backward frontier
-        _, current_backward = heappop(backward_frontier)
-        for neighbor in mesh['adj'][current_backward]:
+class SearchHandle:
+    """
+    The state of a regular A* search between installments, see start_search
 
-            if neighbor not in boxes:
-                neighbor_point = constrain_point_to_box(detail_points[current_backward], neighbor)
-                tentative_dist = backward_dist[current_backward] + heuristic(detail_points[current_backward], neighbor_point)
+    Each call to run picks up the frontier where the previous one stopped, so a query spread over several
+    frames expands every box at most once, as a single regular_a_star would; regular_a_star itself is one
+    run with no budget. Between installments the best partial path leads to the box reached so far with
+    the lowest estimate of remaining distance. corridor holds the boxes that path runs through.
+    """
 
-                if neighbor not in backward_dist or tentative_dist < backward_dist[neighbor]:
-                    backward_dist[neighbor] = tentative_dist
-                    backward_prev[neighbor] = current_backward
+    def __init__(self, source_point, destination_point, mesh, stats=None, report=False):
+        """
+        Args:
+            source_point: starting point of the pathfinder
+            destination_point: the ultimate goal the pathfinder must reach
+            mesh: pathway constraints the path adheres to
+            stats: a SearchStats to fill in with the counters and timings of all installments together
+            report: pass stats to the query hooks once the search is done
+        """
+        started = time.perf_counter()
+        self.source_point = source_point
+        self.destination_point = destination_point
+        self.mesh = mesh
+        self.stats = stats
+        self.done = False
+        self.found = False
+        self.path = []
+        self.corridor = []
+        self._report = report
+        self._frontier = None
+
+        self._version = mesh.get('version')
+        self._graph = graph = mesh_graph(mesh)
+        self._points = graph.points()
+        self._source_box = locate_box(source_point, mesh)
+        self._destination_box = locate_box(destination_point, mesh)
+        if self._source_box is not None:
+            self._points[self._source_box] = source_point
+        if self._destination_box is not None:
+            self._points[self._destination_box] = destination_point
+        if stats is not None:
+            stats.timings['locate'] = time.perf_counter() - started
+
+        if self._source_box is None or self._destination_box is None:
+            logger.debug("No source and/or no destination box found for %s -> %s", source_point, destination_point)
+            self._finish()
+            return
+        if self._source_box == self._destination_box:
+            self.found = True
+            self.path = [source_point, destination_point]
+            self.corridor = [graph.box(self._source_box)]
+            self._finish()
+            return
+
+        logger.debug("Searching from %s to %s", source_point, destination_point)
+        self._frontier = [(0, 0, self._source_box)]
+        self._sequence = 1
+        if stats is not None:
+            stats.add_counts(pushes=1)
+        self._g_score = graph.scores()
+        self._g_score[self._source_box] = 0
+        self._came_from = graph.parents()
+        self._came_from[self._source_box] = graph.no_node
+        self._closed = graph.flags()
+        self._best = self._source_box
+        self._best_estimate = heuristic(source_point, destination_point)
+        self.path = [source_point]
+        self.corridor = [graph.box(self._source_box)]
+
+    def run(self, max_expansions=None, deadline=None):
+        """
+        Continues the search until it finishes, expands max_expansions more boxes, or passes deadline
+
+        Args:
+            max_expansions: the most boxes to expand in this installment, None for no limit
+            deadline: a time.perf_counter() value to stop at, None for no limit
+
+        Returns:
+            A path (list of points) to destination_point if one was found, otherwise the best partial path
+            A list of boxes explored so far
+            Whether the search is done; it is done without a path when none exists
+        """
+        if self.done:
+            return self.path, self._graph.explored(self._points), True
+        if self.mesh.get('version') != self._version:
+            raise ValueError("The mesh changed since the search started, start it again")
+
+        started = time.perf_counter()
+        graph = self._graph
+        frontier = self._frontier
+        g_score = self._g_score
+        came_from = self._came_from
+        closed = self._closed
+        detail_points = self._points
+        destination_point = self.destination_point
+        destination_box = self._destination_box
+        on_expand = self.stats.on_expand if self.stats is not None else None
+        best, best_estimate = self._best, self._best_estimate
+        sequence = self._sequence
+        pushes = pops = stale_pops = expanded = scanned = relaxed = 0
+
+        while frontier:
+            if max_expansions is not None and expanded >= max_expansions:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+
+            _, _, current = heappop(frontier)
+            pops += 1
+            if closed[current]:
+                stale_pops += 1
+                continue
+
+            if current == destination_box:
+                self.found = True
+                break
+
+            closed[current] = True
+            expanded += 1
+            current_point = detail_points[current]
+            current_g_score = g_score[current]
+            if on_expand is not None:
+                on_expand(graph.box(current), current_point, current_g_score)
+
+            x, y = current_point
+            for neighbor, portal in graph.edges(current):
+                if closed[neighbor]:
+                    continue
+
+                scanned += 1
+                px1, px2, py1, py2 = portal
+                nx, ny = max(px1, min(x, px2)), max(py1, min(y, py2))
+                neighbor_point = (nx, ny)
+                tentative_g_score = current_g_score + math.sqrt((x - nx) ** 2 + (y - ny) ** 2)
+
+                if tentative_g_score < g_score[neighbor]:
+                    relaxed += 1
+                    g_score[neighbor] = tentative_g_score
+                    came_from[neighbor] = current
                     detail_points[neighbor] = neighbor_point
-                    heappush(backward_frontier, (tentative_dist + heuristic(neighbor_point, source_point), neighbor))
+                    h_score = heuristic(neighbor_point, destination_point)
+                    if h_score < best_estimate:
+                        best, best_estimate = neighbor, h_score
+                    heappush(frontier, (tentative_g_score + h_score, sequence, neighbor))
+                    sequence += 1
+                    pushes += 1
+        searched = time.perf_counter()
+
+        self._best, self._best_estimate = best, best_estimate
+        self._sequence = sequence
+        if self.found:
+            self.path, self.corridor = self._path_to(destination_box)
+            self.path.append(self.destination_point)
+        elif frontier:
+            self.path, self.corridor = self._path_to(best)
+        else:
+            logger.debug("No path found from %s to %s", self.source_point, self.destination_point)
+            self.path = []
+            self.corridor = []
+
+        if self.stats is not None:
+            self.stats.add_counts(pushes=pushes, pops=pops, stale_pops=stale_pops,
+                                  expanded=expanded, scanned=scanned, relaxed=relaxed)
+            timings = self.stats.timings
+            timings['search'] = timings.get('search', 0) + searched - started
+            timings['reconstruct'] = timings.get('reconstruct', 0) + time.perf_counter() - searched
+
+        if self.found or not frontier:
+            self._finish()
+        return self.path, graph.explored(detail_points), self.done
+
+    def _path_to(self, node):
+        # The points and boxes from the source box to node
+        path = []
+        corridor = []
+        while node != self._graph.no_node:
+            path.append(self._points[node])
+            corridor.append(self._graph.box(node))
+            node = self._came_from[node]
+        path.reverse()
+        corridor.reverse()
+        return path, corridor
+
+    def _finish(self):
+        self.done = True
+        # The frontier and score buffers are no longer needed once the answer is known
+        if self._frontier is not None:
+            self._graph.release(self._points, self._g_score, self._came_from, self._closed)
+        self._frontier = self._g_score = self._came_from = self._closed = None
+        if self.stats is not None and self._report:
+            self.stats.found = self.found
+            for hook in list(_query_hooks):
+                hook(self.stats)
+
+class SearchStats:
+    """
+    Counters and phase timings of one query, filled in by the searches when passed as their stats argument
 
-                    if neighbor in forward_prev:
-                        meeting_box = neighbor
-                        break
+    Counters: heap 'pushes' and 'pops', 'stale_pops' of entries for boxes already expanded, boxes
+    'expanded', neighbors 'scanned' and neighbors 'relaxed' to a shorter distance. 'timings' holds the
+    seconds spent in each phase: 'locate' (finding the endpoint boxes), 'search', 'reconstruct', and
+    'smooth' when the path is smoothed.
 
-        if meeting_box:
-            break
+    on_expand, when given, is called as on_expand(box, point, distance) for every box expanded, with the
+    point the search entered it at and the length of the path so far.
+    """
 
-    # Check if meeting box was found
-    if not meeting_box:
-        print("No path found!")
-        return [], list(detail_points.keys())
-
-    # Reconstruct path from source to meet box
-    current = meeting_box
-    while current is not None:
-        path.append(detail_points[current])
-        current = forward_prev[current]
-    path.reverse()
-
-    current = backward_prev[meeting_box]
-    while current is not None:
-        path.append(detail_points[current])
-        current = backward_prev[current]
-
-    if path[0] != source_point:
-        path.insert(0, source_point)
-    if path[-1] != destination_point:
-        path.append(destination_point)
-
-    return path, list(detail_points.keys())
+    COUNTERS = ('pushes', 'pops', 'stale_pops', 'expanded', 'scanned', 'relaxed')
+
+    def __init__(self, on_expand=None):
+        self.on_expand = on_expand
+        self.algorithm = None
+        self.source_point = None
+        self.destination_point = None
+        self.found = None
+        self.timings = {}
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+
+    def add_counts(self, **counts):
+        for name, count in counts.items():
+            setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self):
+        """
+        Returns:
+            The query, its counters and timings as a plain dict
+        """
+        result = {'algorithm': self.algorithm,
+                  'source_point': self.source_point,
+                  'destination_point': self.destination_point,
+                  'found': self.found,
+                  'timings': dict(self.timings)}
+        result.update((name, getattr(self, name)) for name in self.COUNTERS)
+        return result
+
+# Functions called with the SearchStats of every query once it finishes
+_query_hooks = []
+
+def add_query_hook(hook):
+    """
+    Registers hook to be called as hook(stats) with a filled in SearchStats after every search
+
+    While any hook is registered, every query collects its counters even if its caller passed no stats.
+    """
+    _query_hooks.append(hook)
+
+def remove_query_hook(hook):
+    _query_hooks.remove(hook)
+
+def _run_search(search, algorithm, source_point, destination_point, mesh, stats):
+    if stats is None and _query_hooks:
+        stats = SearchStats()
+    if stats is not None:
+        stats.algorithm = algorithm
+        stats.source_point = source_point
+        stats.destination_point = destination_point
+
+    result = search(source_point, destination_point, mesh, stats)
+
+    if stats is not None:
+        stats.found = bool(result[0])
+        for hook in list(_query_hooks):
+            hook(stats)
+    return result
+
+# Searches selectable by name in find_path and find_paths
+ALGORITHMS = {
+    'regular': regular_a_star,
+    'bidirectional': bidirectional_a_star,
+}
+
+# The same searches, also returning the corridor of boxes the path runs through
+_CORRIDOR_SEARCHES = {
+    'regular': _regular_a_star,
+    'bidirectional': _bidirectional_a_star,
+}
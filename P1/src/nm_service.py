@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import time
+
+from nm_compact import load_mesh
+from nm_parallel import _pool_context
+import nm_pathfinder
+
+logger = logging.getLogger(__name__)
+
+# A path query service for many concurrent clients. Requests and responses are JSON objects, one per line:
+#     {"id": 7, "map": "homer.png", "source": [x, y], "destination": [x, y],
+#      "algorithm": "regular", "smooth": false, "max_expansions": 5000, "timeout": 0.05}
+#     {"id": 7, "status": "ok", "found": true, "path": [[x, y], ...], "expanded": 312, "seconds": 0.004}
+# Only map, source and destination are required. Responses are written as soon as each search finishes,
+# so they may come back in a different order than the requests, and carry the id of their request.
+# status is "ok", "over_budget" when the search ran out of expansions, "timeout", or "error" with a message.
+
+# The meshes each worker process answers queries against
+_worker_meshes = None
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised inside a search that used up the expansions or time it was allowed
+    """
+
+    def __init__(self, status, expanded):
+        super().__init__(status)
+        self.status = status
+        self.expanded = expanded
+
+
+def _init_worker(meshes):
+    global _worker_meshes
+    _worker_meshes = meshes
+
+
+def _run_query(query, meshes=None):
+    # Runs in the executor. deadline is on the time.monotonic clock, which worker processes share
+    map_name, source_point, destination_point, algorithm, smooth, max_expansions, deadline = query
+    mesh = (meshes if meshes is not None else _worker_meshes)[map_name]
+    expanded = 0
+
+    def on_expand(box, point, distance):
+        nonlocal expanded
+        expanded += 1
+        if max_expansions is not None and expanded > max_expansions:
+            raise BudgetExceeded('over_budget', expanded - 1)
+        if deadline is not None and time.monotonic() > deadline:
+            raise BudgetExceeded('timeout', expanded)
+
+    start = time.perf_counter()
+    try:
+        path, _ = nm_pathfinder.find_path(source_point, destination_point, mesh, algorithm,
+                                          nm_pathfinder.SearchStats(on_expand), smooth)
+    except BudgetExceeded as e:
+        return {'status': e.status, 'found': False, 'path': [], 'expanded': e.expanded,
+                'seconds': time.perf_counter() - start}
+
+    return {'status': 'ok',
+            'found': bool(path),
+            'path': [[float(x), float(y)] for x, y in path],
+            'expanded': expanded,
+            'seconds': time.perf_counter() - start}
+
+
+class QueryService:
+    """
+    Answers path queries against preloaded meshes from an asyncio event loop
+
+    Searches run in an executor so the loop keeps reading requests while they run: a pool of worker
+    processes that each hold the meshes, or with processes=0 a single thread of this process. Identical
+    queries in flight at the same time share one search.
+
+    Each request may set its own max_expansions and timeout (seconds, counted from when it arrives);
+    otherwise the service defaults apply. A search is stopped at the first box it expands past its budget.
+    """
+
+    def __init__(self, meshes, processes=None, max_expansions=None, timeout=None):
+        """
+        Args:
+            meshes: dict mapping a map name to its mesh
+            processes: number of worker processes, defaults to the number of cores, 0 searches in a thread
+            max_expansions: default limit on boxes expanded per query, None for no limit
+            timeout: default limit in seconds per query, None for no limit
+        """
+        self.meshes = dict(meshes)
+        self.max_expansions = max_expansions
+        self.timeout = timeout
+        self.searches = 0
+        self.coalesced = 0
+        self._in_flight = {}
+
+        # Build the point indexes before starting the workers so they all inherit them
+        for mesh in self.meshes.values():
+            nm_pathfinder.box_index(mesh)
+
+        if processes == 0:
+            self._executor = concurrent.futures.ThreadPoolExecutor(1)
+            self._meshes_arg = (self.meshes,)
+        else:
+            self._executor = concurrent.futures.ProcessPoolExecutor(processes or os.cpu_count() or 1, _pool_context(),
+                                                                    _init_worker, (self.meshes,))
+            self._meshes_arg = ()
+            # Start the workers now, before any connection is open, so they do not inherit client sockets
+            self._executor.submit(int).result()
+
+    async def query(self, request):
+        """
+        Answers one request
+
+        Args:
+            request: a dict with the fields of a request line
+
+        Returns:
+            The response as a dict
+        """
+        arrival = time.monotonic()
+        response = {'id': request.get('id')}
+        try:
+            map_name = request['map']
+            source_point = tuple(float(v) for v in request['source'])
+            destination_point = tuple(float(v) for v in request['destination'])
+            algorithm = request.get('algorithm', 'regular')
+            smooth = bool(request.get('smooth', False))
+            max_expansions = request.get('max_expansions', self.max_expansions)
+            timeout = request.get('timeout', self.timeout)
+            if map_name not in self.meshes:
+                raise ValueError("Unknown map %r" % (map_name,))
+            if algorithm not in nm_pathfinder.ALGORITHMS:
+                raise ValueError("Unknown algorithm %r, expected one of %s"
+                                 % (algorithm, ', '.join(nm_pathfinder.ALGORITHMS)))
+            if len(source_point) != 2 or len(destination_point) != 2:
+                raise ValueError("Points must be [x, y] pairs")
+            if max_expansions is not None and (type(max_expansions) is not int or max_expansions < 0):
+                raise ValueError("max_expansions must be a non-negative integer")
+            if timeout is not None and (type(timeout) not in (int, float) or not timeout >= 0):
+                raise ValueError("timeout must be a non-negative number of seconds")
+        except (KeyError, TypeError, ValueError) as e:
+            response.update(status='error', error=str(e) if not isinstance(e, KeyError) else "Missing %s" % e)
+            return response
+
+        key = (map_name, source_point, destination_point, algorithm, smooth, max_expansions, timeout)
+        future = self._in_flight.get(key)
+        if future is None:
+            deadline = arrival + timeout if timeout is not None else None
+            query = (map_name, source_point, destination_point, algorithm, smooth, max_expansions, deadline)
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, _run_query, query, *self._meshes_arg)
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            self.searches += 1
+        else:
+            self.coalesced += 1
+
+        try:
+            if timeout is None:
+                result = await asyncio.shield(future)
+            else:
+                # Answer on time even while the search still waits behind others for a worker
+                result = await asyncio.wait_for(asyncio.shield(future), max(0, arrival + timeout - time.monotonic()))
+        except asyncio.TimeoutError:
+            response.update(status='timeout', found=False, path=[], expanded=0, seconds=time.monotonic() - arrival)
+            return response
+        except Exception as e:
+            logger.exception("Query %r failed", key)
+            response.update(status='error', error=str(e))
+            return response
+
+        response.update(result)
+        return response
+
+    async def handle(self, reader, writer):
+        """
+        Serves one connection: reads request lines and writes each response line as soon as it is ready
+        """
+        pending = set()
+
+        async def answer(line):
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("A request must be a JSON object")
+            except ValueError as e:
+                response = {'id': None, 'status': 'error', 'error': str(e)}
+            else:
+                try:
+                    response = await self.query(request)
+                except Exception as e:
+                    # A request must never go unanswered, whatever it holds
+                    logger.exception("Request %r failed", request)
+                    response = {'id': request.get('id'), 'status': 'error', 'error': str(e)}
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(answer(line))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        except ConnectionError:
+            for task in pending:
+                task.cancel()
+        finally:
+            writer.close()
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+async def serve_socket(service, path):
+    """
+    Serves clients connecting to a Unix domain socket at path until cancelled
+    """
+    server = await asyncio.start_unix_server(service.handle, path)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_tcp(service, port, host='127.0.0.1'):
+    """
+    Serves clients connecting over TCP until cancelled, by default only from this machine
+    """
+    server = await asyncio.start_server(service.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_stdio(service):
+    """
+    Serves requests read from stdin, writing the responses to stdout, until stdin closes
+
+    stdout must be a pipe or a terminal.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    await service.handle(reader, writer)
+
+
+def map_name(filename):
+    """
+    Returns:
+        The name a mesh file is served under, the name of its map: homer.png for homer.png.mesh.pickle
+    """
+    name = os.path.basename(filename)
+    for suffix in ('.mesh.pickle', '.mesh.bin'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Serve path queries over a local socket or stdio")
+    parser.add_argument('meshes', nargs='+', help="mesh files (.mesh.pickle or .mesh.bin), served by map name")
+    transport = parser.add_mutually_exclusive_group(required=True)
+    transport.add_argument('--socket', help="path of a Unix domain socket to listen on")
+    transport.add_argument('--port', type=int, help="TCP port to listen on at 127.0.0.1")
+    transport.add_argument('--stdio', action='store_true', help="read requests from stdin")
+    parser.add_argument('--processes', type=int, help="worker processes, 0 searches in a thread")
+    parser.add_argument('--max-expansions', type=int, help="default limit on boxes expanded per query")
+    parser.add_argument('--timeout', type=float, help="default limit in seconds per query")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', stream=sys.stderr)
+    service = QueryService({map_name(filename): load_mesh(filename) for filename in args.meshes},
+                           args.processes, args.max_expansions, args.timeout)
+    try:
+        if args.socket:
+            asyncio.run(serve_socket(service, args.socket))
+        elif args.port is not None:
+            asyncio.run(serve_tcp(service, args.port))
+        else:
+            asyncio.run(serve_stdio(service))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
@@ -0,0 +1,166 @@
+import collections
+import os
+
+from matplotlib.pyplot import imread
+import numpy
+import pytest
+
+from nm_meshbuilder import build_mesh, build_mesh_tiled
+
+
+INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+
+
+def recursive_build_mesh(image, min_feature_size):
+    # The recursive builder build_mesh replaced, kept as the reference it must match box for box. Mixed
+    # boxes two pixels long are cut on their far edge and recurse forever, so it is only given images and
+    # sizes where no such box gets split.
+    def scan(box):
+        x1, x2, y1, y2 = box
+        area = (x2 - x1) * (y2 - y1)
+
+        if area < min_feature_size or (image[x1:x2, y1:y2] == 255).all() or (image[x1:x2, y1:y2] == 0).all():
+            if (image[x1:x2, y1:y2] == 255).all():
+                return [box], []
+            return [], []
+
+        if x2 - x1 > y2 - y1:
+            cut = int(x1 + (x2 - x1) / 2 + 1)
+            first_box, second_box = (x1, cut, y1, y2), (cut, x2, y1, y2)
+            def rank(b): return (b[2], b[3])
+            def first_touch(b): return b[1] == cut
+            def second_touch(b): return b[0] == cut
+        else:
+            cut = int(y1 + (y2 - y1) / 2 + 1)
+            first_box, second_box = (x1, x2, y1, cut), (x1, x2, cut, y2)
+            def rank(b): return (b[0], b[1])
+            def first_touch(b): return b[3] == cut
+            def second_touch(b): return b[2] == cut
+
+        first_boxes, first_edges = scan(first_box)
+        second_boxes, second_edges = scan(second_box)
+
+        my_boxes = [fb for fb in first_boxes if not first_touch(fb)]
+        my_boxes.extend([sb for sb in second_boxes if not second_touch(sb)])
+        my_edges = []
+
+        first_touches = sorted(filter(first_touch, first_boxes), key=rank)
+        second_touches = sorted(filter(second_touch, second_boxes), key=rank)
+        first_merges = {}
+        second_merges = {}
+
+        while first_touches and second_touches:
+            f, s = first_touches[0], second_touches[0]
+            rf, rs = rank(f), rank(s)
+            if rf == rs:
+                first_touches.pop(0)
+                second_touches.pop(0)
+                merged = (f[0], s[1], f[2], s[3])
+                first_merges[f] = merged
+                second_merges[s] = merged
+                my_boxes.append(merged)
+            elif rf[1] < rs[1]:
+                my_boxes.append(first_touches.pop(0))
+                if rf[1] >= rs[0]:
+                    my_edges.append((f, s))
+            elif rf[1] > rs[1]:
+                my_boxes.append(second_touches.pop(0))
+                if rf[0] <= rs[1]:
+                    my_edges.append((f, s))
+            else:
+                my_boxes.append(first_touches.pop(0))
+                my_boxes.append(second_touches.pop(0))
+                my_edges.append((f, s))
+
+        my_boxes.extend(first_touches)
+        my_boxes.extend(second_touches)
+        for a, b in first_edges:
+            my_edges.append((first_merges.get(a, a), first_merges.get(b, b)))
+        for a, b in second_edges:
+            my_edges.append((second_merges.get(a, a), second_merges.get(b, b)))
+        return my_boxes, my_edges
+
+    boxes, edges = scan((0, image.shape[0], 0, image.shape[1]))
+
+    adj = collections.defaultdict(list)
+    for a, b in edges:
+        adj[a].append(b)
+        adj[b].append(a)
+
+    return {'boxes': list(adj.keys()), 'adj': dict(adj)}
+
+
+def load_map(name):
+    # Read the way the recursive builder's command line read maps
+    image = (imread(os.path.join(INPUT, name)) * 255).astype(dtype=numpy.uint8)
+    return image[:, :, 0] if len(image.shape) > 2 else image
+
+
+def random_image(seed, shape, open_fraction, gray=False):
+    rng = numpy.random.default_rng(seed)
+    image = numpy.where(rng.random(shape) < open_fraction, 255, 0).astype(numpy.uint8)
+    if gray:
+        image[rng.random(shape) < 0.05] = 128
+    return image
+
+
+def assert_same_mesh(mesh, expected):
+    # Lists compare in order, so this also checks the order of boxes and of every box's neighbors
+    assert mesh['boxes'] == expected['boxes']
+    assert mesh['adj'] == expected['adj']
+
+
+def assert_valid_mesh(mesh, image):
+    # Boxes are walkable, do not overlap, and neighbors touch along an edge
+    covered = numpy.zeros(image.shape, dtype=int)
+    for x1, x2, y1, y2 in mesh['boxes']:
+        assert x1 < x2 and y1 < y2
+        assert (image[x1:x2, y1:y2] == 255).all()
+        covered[x1:x2, y1:y2] += 1
+    assert covered.max() <= 1
+    for box, neighbors in mesh['adj'].items():
+        for neighbor in neighbors:
+            assert box in mesh['adj'][neighbor]
+            x_gap = max(box[0], neighbor[0]) - min(box[1], neighbor[1])
+            y_gap = max(box[2], neighbor[2]) - min(box[3], neighbor[3])
+            assert (x_gap == 0 and y_gap < 0) or (y_gap == 0 and x_gap < 0)
+    return covered
+
+
+@pytest.mark.parametrize('min_feature_size', [8, 16, 64])
+@pytest.mark.parametrize('name', ['homer.png', 'test_image.png', 'ucsc_banana_slug.png'])
+def test_sample_maps(name, min_feature_size):
+    image = load_map(name)
+    assert_same_mesh(build_mesh(image, min_feature_size), recursive_build_mesh(image, min_feature_size))
+
+
+@pytest.mark.parametrize('seed, shape, open_fraction, min_feature_size, gray', [
+    (1, (37, 53), 0.5, 5, False),
+    (2, (64, 64), 0.8, 5, False),
+    (3, (101, 17), 0.3, 8, False),
+    (4, (50, 77), 0.9, 16, True),
+    (5, (1, 40), 0.6, 5, False),
+])
+def test_random_images(seed, shape, open_fraction, min_feature_size, gray):
+    image = random_image(seed, shape, open_fraction, gray)
+    assert_same_mesh(build_mesh(image, min_feature_size), recursive_build_mesh(image, min_feature_size))
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_tiled(processes):
+    for image, min_feature_size in [(load_map('test_image.png'), 16), (random_image(6, (90, 70), 0.7), 5)]:
+        expected = recursive_build_mesh(image, min_feature_size)
+        assert_same_mesh(build_mesh_tiled(image, min_feature_size, processes=processes), expected)
+
+
+def test_two_pixel_boxes():
+    # Mixed boxes two pixels long with min_feature_size under their area used to recurse forever
+    image = numpy.array([[255, 0, 255, 255, 255, 0, 255],
+                         [255, 255, 255, 0, 255, 255, 255]], dtype=numpy.uint8)
+    for min_feature_size in [1, 2, 3, 4]:
+        mesh = build_mesh(image, min_feature_size)
+        covered = assert_valid_mesh(mesh, image)
+        if min_feature_size < 3:
+            # Small enough that every walkable pixel ends up in a box
+            assert (covered == (image == 255)).all()
+        assert_same_mesh(build_mesh_tiled(image, min_feature_size, processes=3, tiles_per_process=1), mesh)